@@ -0,0 +1,59 @@
+import threading
+from concurrent.futures import Future
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+
+class WordCoalescer:
+    """
+    Single flight for word predictions running concurrently on the inference threads.
+
+    A caller claims the keys it is about to predict. Keys nobody else is predicting are returned for the caller
+    to predict, for keys already in flight it gets the pending future of the thread predicting them instead.
+    Owners predict and resolve their keys before waiting on anyone else's, so callers never wait on each other
+    in a cycle.
+    """
+    def __init__(self) -> None:
+        self.predicted = 0
+        self.coalesced = 0
+        self._pending: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, keys: Iterable[Hashable]) -> Tuple[List[Hashable], Dict[Hashable, Future]]:
+        owned = []
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                future = self._pending.get(key)
+                if future is None:
+                    self._pending[key] = Future()
+                    owned.append(key)
+                else:
+                    waiting[key] = future
+            self.predicted += len(owned)
+            self.coalesced += len(waiting)
+        return owned, waiting
+
+    def resolve(self, results: Dict[Hashable, str]) -> None:
+        with self._lock:
+            futures = [(self._pending.pop(key), value) for key, value in results.items()]
+        for future, value in futures:
+            future.set_result(value)
+
+    def fail(self, keys: Iterable[Hashable], exc: BaseException) -> None:
+        # Waiters see the owner's error instead of blocking forever
+        with self._lock:
+            futures = [self._pending.pop(key) for key in keys if key in self._pending]
+        for future in futures:
+            future.set_exception(exc)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        requested = self.predicted + self.coalesced
+        return {
+            'in_flight': len(self),
+            'predicted': self.predicted,
+            'coalesced': self.coalesced,
+            'saved_rate': self.coalesced / requested if requested > 0 else 0.0,
+        }
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing work when the executor is saturated"""
+    def __init__(self, message: str, retry_after: int) -> None:
+        super(Overloaded, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a job's deadline passed while it was waiting, the job is dropped without running"""
+
+
+class InferenceExecutor:
+    """
+    Runs CPU bound segmentation work on a dedicated thread pool so the asyncio event loop stays responsive.
+
+    At most `workers` jobs run at once. Admission control keeps the backlog bounded: a job is rejected with
+    `Overloaded` when `queue_size` jobs are already waiting for a worker or when admitting it would put more
+    than `max_queued_words` words in flight. Jobs whose deadline has passed by the time a worker picks them up
+    are dropped before the forward pass.
+    """
+    def __init__(self, workers: int, queue_size: int, max_queued_words: int, retry_after: int = 1) -> None:
+        if workers < 1:
+            raise ValueError("workers must be at least 1.")
+        if queue_size < 0:
+            raise ValueError("queue_size must be non-negative.")
+
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_queued_words = max_queued_words
+        self.retry_after = retry_after
+        self.jobs = 0
+        self.queued_words = 0
+        self.rejected = 0
+        self.expired = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+
+    def _admit(self, words: int) -> None:
+        # Counters are only touched from the event loop thread, so no lock is needed
+        if self.jobs >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise Overloaded("Inference queue is full.", self.retry_after)
+        # A single oversized job is still admitted when nothing else is running, otherwise it could never run
+        if self.jobs > 0 and self.queued_words + words > self.max_queued_words:
+            self.rejected += 1
+            raise Overloaded("Too many words queued for inference.", self.retry_after)
+
+    def _call(self, fn: Callable[..., Any], args: tuple, kwargs: dict, deadline: Optional[float]) -> Any:
+        if deadline is not None and time.monotonic() > deadline:
+            self.expired += 1
+            raise DeadlineExceeded("Request deadline passed before inference started.")
+        return fn(*args, **kwargs)
+
+    async def run(self, fn: Callable[..., Any], *args, words: int = 0, deadline: Optional[float] = None,
+                  **kwargs) -> Any:
+        """
+        Run `fn(*args, **kwargs)` on the pool. `words` is the job's size for admission control and `deadline`
+        an optional `time.monotonic()` timestamp after which the job is no longer worth running.
+        """
+        self._admit(words)
+        loop = asyncio.get_running_loop()
+        future = self._pool.submit(self._call, fn, args, kwargs, deadline)
+        self.jobs += 1
+        self.queued_words += words
+        # Released when the job is done, not when the request stops waiting for it: a cancelled request leaves its
+        # forward pass running on a worker, which must keep counting against the limits until it finishes
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release, words))
+        return await asyncio.wrap_future(future)
+
+    def _release(self, words: int) -> None:
+        self.jobs -= 1
+        self.queued_words -= words
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
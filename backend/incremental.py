@@ -0,0 +1,65 @@
+import difflib
+from typing import Dict, List, Optional
+
+from testmorphseg import MorphemeSegmenter
+from testmorphseg.utils.cache import LRUCache
+
+from coalesce import WordCoalescer
+from metrics import ServiceMetrics
+from segmentation import WORD_PATTERN, segment_words, split_segmentation
+
+
+class IncrementalSession:
+    """
+    Segmentation state of one as-you-type connection.
+
+    Every update is diffed word by word against the previous text and only the words of changed spans that
+    the session has not segmented before are sent to the model. The result is a list of edit operations
+    against the previous word list: each op replaces old words [start, end) with `segments`. Ops refer to
+    indices of the previous list and are sorted by position, so clients apply them from last to first.
+    """
+    def __init__(self, segmenter: MorphemeSegmenter, delimiter: str = " @@", cache: Optional[LRUCache] = None,
+                 model_id: str = "", metrics: Optional[ServiceMetrics] = None,
+                 coalescer: Optional[WordCoalescer] = None) -> None:
+        self.segmenter = segmenter
+        self.delimiter = delimiter
+        self.cache = cache
+        self.model_id = model_id
+        self.metrics = metrics
+        self.coalescer = coalescer
+        self.words: List[str] = []
+        self.segmentations: List[str] = []
+
+    def update(self, text: str) -> Dict:
+        words = [word.lower() for word in WORD_PATTERN.findall(text)]
+        opcodes = [
+            opcode for opcode in difflib.SequenceMatcher(a=self.words, b=words, autojunk=False).get_opcodes()
+            if opcode[0] != "equal"
+        ]
+
+        # Words already segmented in the previous text need no prediction, even if they moved
+        known = dict(zip(self.words, self.segmentations))
+        unknown = list(dict.fromkeys(
+            word for _, _, _, j1, j2 in opcodes for word in words[j1:j2] if word not in known
+        ))
+        if unknown:
+            segmented = segment_words(
+                self.segmenter, unknown, delimiter=self.delimiter, cache=self.cache, model_id=self.model_id,
+                metrics=self.metrics, coalescer=self.coalescer
+            )
+            known.update(zip(unknown, segmented))
+        if self.metrics is not None:
+            self.metrics.observe_words(len(unknown))
+
+        ops = [
+            {
+                'start': i1,
+                'end': i2,
+                'segments': [split_segmentation(known[word], self.delimiter) for word in words[j1:j2]],
+            }
+            for _, i1, i2, j1, j2 in opcodes
+        ]
+
+        self.words = words
+        self.segmentations = [known[word] for word in words]
+        return {'num_words': len(words), 'ops': ops}
@@ -0,0 +1,200 @@
+"""
+Load generator for the segmentation backend.
+
+Replays a word frequency corpus against /seg_list, /seg_string and /segment at fixed request rates and
+concurrency levels and prints RPS, latency percentiles and error rates as JSON, so builds can be compared.
+Requests are sent open loop: each one is scheduled at a fixed rate and its latency is measured from its
+scheduled start, so a slow server can't hide queueing delay by slowing the client down.
+
+Without --url the backend in main.py is started in-process on a free port.
+
+Usage:
+    python loadtest.py --rates 50,200 --concurrency 8,32 --duration 10 > results.json
+    python loadtest.py --url http://localhost:8000 --corpus words.tsv --endpoints seg_list,segment
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "..", "library", "data", "en", "test.tsv")
+ENDPOINTS = ["seg_list", "seg_string", "segment"]
+
+
+def load_corpus(path: str, limit: int = 10_000) -> Tuple[List[str], List[float]]:
+    """
+    Read `word<TAB>count` lines, or plain words without counts.
+    Words without a count get Zipfian weights by their rank in the file, like natural text.
+    """
+    words = []
+    weights = []
+    with open(path, encoding="utf-8") as corpus_file:
+        for rank, line in enumerate(corpus_file, start=1):
+            fields = line.rstrip("\n").split("\t")
+            if not fields[0]:
+                continue
+            count = float(fields[1]) if len(fields) == 2 and fields[1].replace(".", "", 1).isdigit() else None
+            words.append(fields[0])
+            weights.append(count if count is not None else 1.0 / rank)
+            if len(words) >= limit:
+                break
+    return words, weights
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    # Nearest rank percentile
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class RequestFactory:
+    def __init__(self, words: List[str], weights: List[float], words_per_request: int, texts_per_batch: int,
+                 seed: int = 0) -> None:
+        self.words = words
+        self.weights = weights
+        self.words_per_request = words_per_request
+        self.texts_per_batch = texts_per_batch
+        self.random = random.Random(seed)
+
+    def _text(self) -> str:
+        return " ".join(self.random.choices(self.words, weights=self.weights, k=self.words_per_request))
+
+    def build(self, endpoint: str) -> Tuple[str, str, Optional[dict]]:
+        if endpoint == "segment":
+            return "POST", "/segment", {"texts": [self._text() for _ in range(self.texts_per_batch)]}
+        return "GET", f"/{endpoint}/{quote(self._text())}", None
+
+
+async def run_level(client: httpx.AsyncClient, factory: RequestFactory, endpoint: str, rate: float,
+                    concurrency: int, duration: float) -> Dict:
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    total = int(rate * duration)
+
+    async def send(scheduled: float) -> None:
+        nonlocal errors
+        method, path, body = factory.build(endpoint)
+        async with slots:
+            try:
+                response = await client.request(method, path, json=body)
+                if response.status_code >= 400:
+                    errors += 1
+                    return
+            except httpx.HTTPError:
+                errors += 1
+                return
+        latencies.append(time.perf_counter() - scheduled)
+
+    start = time.perf_counter()
+    tasks = []
+    for i in range(total):
+        scheduled = start + i / rate
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        tasks.append(asyncio.create_task(send(scheduled)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'endpoint': endpoint,
+        'target_rate': rate,
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': errors,
+        'error_rate': errors / total if total > 0 else 0.0,
+        'rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'p50': _ms(percentile(latencies, 50)),
+            'p95': _ms(percentile(latencies, 95)),
+            'p99': _ms(percentile(latencies, 99)),
+            'mean': _ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max': _ms(latencies[-1]) if latencies else None,
+        },
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(1000 * seconds, 3) if seconds is not None else None
+
+
+def start_in_process() -> str:
+    """Start main.app with uvicorn in a background thread and return its base URL"""
+    import uvicorn
+    import main
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"Backend was not ready after {timeout} seconds")
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    base_url = args.url or start_in_process()
+    words, weights = load_corpus(args.corpus)
+    factory = RequestFactory(words, weights, args.words_per_request, args.texts_per_batch, seed=args.seed)
+
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        await wait_until_ready(client, args.ready_timeout)
+        results = []
+        for endpoint in args.endpoints:
+            for rate in args.rates:
+                for concurrency in args.concurrency:
+                    results.append(await run_level(client, factory, endpoint, rate, concurrency, args.duration))
+
+    return {
+        'base_url': base_url,
+        'corpus': os.path.abspath(args.corpus),
+        'duration_s': args.duration,
+        'words_per_request': args.words_per_request,
+        'texts_per_batch': args.texts_per_batch,
+        'results': results,
+    }
+
+
+def _csv(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the MorphSeg backend")
+    parser.add_argument("--url", default=None, help="Backend base URL, starts main.py in-process if omitted")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="word<TAB>count lines, or one word per line")
+    parser.add_argument("--endpoints", type=_csv(str), default=ENDPOINTS)
+    parser.add_argument("--rates", type=_csv(float), default=[10.0, 50.0, 200.0], help="Requests per second")
+    parser.add_argument("--concurrency", type=_csv(int), default=[1, 8, 32], help="Max requests in flight")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per rate/concurrency level")
+    parser.add_argument("--words-per-request", type=int, default=8)
+    parser.add_argument("--texts-per-batch", type=int, default=16, help="Texts per POST /segment request")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    report = asyncio.run(run(parser.parse_args()))
+    print(json.dumps(report, indent=2))
@@ -1,8 +1,145 @@
-from fastapi import FastAPI
+import asyncio
+import hashlib
+import hmac
+import logging
+import math
+import os
+import time
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import torch
+from fastapi import (
+    Depends, FastAPI, Header, HTTPException, Request, Response, UploadFile, WebSocket, WebSocketDisconnect
+)
 from fastapi.middleware.cors import CORSMiddleware
-from testmorphseg import MorphemeSegmenter
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+from pydantic import BaseModel
+from testmorphseg.utils.cache import LRUCache
+
+from coalesce import WordCoalescer
+from executor import DeadlineExceeded, InferenceExecutor, Overloaded
+from incremental import IncrementalSession
+from metrics import ServiceMetrics
+from registry import ModelRegistry
+from segmentation import count_words, segment_texts
+from streaming import NDJSONResponse, iter_upload, stream_segmentations
+
+# Comma separated list of languages to load at startup, e.g. "cs,en". Only "cs" has a pretrained model, other
+# languages need a checkpoint in MORPHSEG_MODEL_PATHS
+MORPHSEG_LANGS = [lang.strip() for lang in os.environ.get("MORPHSEG_LANGS", "cs").split(",") if lang.strip()]
+DEFAULT_LANG = MORPHSEG_LANGS[0]
+# Optional checkpoint per language, e.g. "en=/models/en.pt,cs=/models/cs.pt". Languages without one use the
+# pretrained model shipped with the library
+MODEL_PATHS = dict(
+    item.split("=", 1) for item in os.environ.get("MORPHSEG_MODEL_PATHS", "").split(",") if "=" in item
+)
+# Seconds between checks of the checkpoint files for changes, a changed file is hot reloaded. 0 disables watching
+RELOAD_POLL_INTERVAL = float(os.environ.get("MORPHSEG_RELOAD_POLL_INTERVAL", 0))
+# Token expected in the X-Admin-Token header of admin endpoints, which are disabled when it is unset
+ADMIN_TOKEN = os.environ.get("MORPHSEG_ADMIN_TOKEN", "")
+# Cores this process may use. serve.py lowers it to each pre-forked worker's share of the machine
+CPU_BUDGET = int(os.environ.get("MORPHSEG_CPU_BUDGET", os.cpu_count() or 1))
+# Number of forward passes allowed to run at once, and how many more may wait for a free worker
+INFERENCE_WORKERS = int(os.environ.get("MORPHSEG_INFERENCE_WORKERS", CPU_BUDGET))
+INFERENCE_QUEUE_SIZE = int(os.environ.get("MORPHSEG_INFERENCE_QUEUE_SIZE", 64))
+# Admission control: words allowed in flight before new work is shed, the default time budget of a request
+# in seconds, and the Retry-After sent with 503 responses
+MAX_QUEUED_WORDS = int(os.environ.get("MORPHSEG_MAX_QUEUED_WORDS", 50_000))
+REQUEST_TIMEOUT = float(os.environ.get("MORPHSEG_REQUEST_TIMEOUT", 10.0))
+RETRY_AFTER = int(os.environ.get("MORPHSEG_RETRY_AFTER", 1))
+# Number of segmented words kept in memory
+WORD_CACHE_SIZE = int(os.environ.get("MORPHSEG_WORD_CACHE_SIZE", 100_000))
+# Number of words per inference batch (and per NDJSON record) on the streaming endpoints
+STREAM_CHUNK_WORDS = int(os.environ.get("MORPHSEG_STREAM_CHUNK_WORDS", 512))
+# Words and batch sizes run through every model before the service reports ready
+WARMUP_WORDS = os.environ.get(
+    "MORPHSEG_WARMUP_WORDS",
+    "the,unbelievably,disagreeable,preprocessor,unsuccessfully,reprocessed,irreversible,decontextualization"
+).split(",")
+WARMUP_BATCH_SIZES = [int(size) for size in os.environ.get("MORPHSEG_WARMUP_BATCH_SIZES", "1,8,32").split(",")]
+
+logger = logging.getLogger(__name__)
+
+
+# Set by serve.py when the master process has already loaded the models into shared memory before forking
+preloaded_registry: Optional[ModelRegistry] = None
+
+
+def _load_models(registry: ModelRegistry) -> None:
+    if not registry.is_loaded():
+        registry.load()
+    registry.warmup(words=[word for word in WARMUP_WORDS if word], batch_sizes=WARMUP_BATCH_SIZES)
+
+
+async def _reload_model(app: FastAPI, lang: str) -> str:
+    # Loading and warming up take seconds, run them off the event loop so requests keep being served
+    try:
+        model = await asyncio.to_thread(
+            app.state.registry.reload, lang, words=[word for word in WARMUP_WORDS if word],
+            batch_sizes=WARMUP_BATCH_SIZES
+        )
+    except Exception:
+        app.state.metrics.observe_reload(lang, "error")
+        raise
+    app.state.metrics.observe_reload(lang, "success")
+    return model.fingerprint
+
+
+async def _watch_checkpoints(app: FastAPI) -> None:
+    registry = app.state.registry
+    # Start from the files the startup load used, a failed startup load is retried on the next change
+    await asyncio.wait([app.state.loading])
+    mtimes = registry.checkpoint_mtimes()
+    while True:
+        await asyncio.sleep(RELOAD_POLL_INTERVAL)
+        for lang, mtime in registry.checkpoint_mtimes().items():
+            if mtimes.get(lang) == mtime:
+                continue
+            mtimes[lang] = mtime
+            try:
+                fingerprint = await _reload_model(app, lang)
+                logger.info("Reloaded model for '%s' from %s, fingerprint %s", lang, registry.model_paths[lang],
+                            fingerprint)
+            except Exception as exc:
+                # Keep serving the old model, the next change of the file triggers another attempt
+                logger.warning("Reloading model for '%s' failed: %r", lang, exc)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Split the cores between inference workers so concurrent forward passes don't oversubscribe the CPU
+    torch.set_num_threads(max(1, CPU_BUDGET // INFERENCE_WORKERS))
+    # Load and warm every model once in the background. /health answers right away,
+    # /ready and the segmentation endpoints only once all models are warm
+    app.state.registry = preloaded_registry or ModelRegistry(langs=MORPHSEG_LANGS, model_paths=MODEL_PATHS)
+    app.state.registry.set_stage_timer(app.state.metrics.observe_stage)
+    app.state.loading = asyncio.create_task(asyncio.to_thread(_load_models, app.state.registry))
+    app.state.executor = InferenceExecutor(
+        workers=INFERENCE_WORKERS, queue_size=INFERENCE_QUEUE_SIZE, max_queued_words=MAX_QUEUED_WORDS,
+        retry_after=RETRY_AFTER
+    )
+    app.state.metrics.track_executor(app.state.executor)
+    app.state.word_cache = LRUCache(capacity=WORD_CACHE_SIZE)
+    app.state.metrics.track_word_cache(app.state.word_cache)
+    # Concurrent requests wait on words another request is already predicting instead of predicting them again
+    app.state.coalescer = WordCoalescer()
+    app.state.metrics.track_coalescer(app.state.coalescer)
+    app.state.watcher = asyncio.create_task(_watch_checkpoints(app)) if RELOAD_POLL_INTERVAL > 0 else None
+    yield
+    if app.state.watcher is not None:
+        app.state.watcher.cancel()
+    app.state.loading.cancel()
+    app.state.executor.shutdown()
+    app.state.word_cache.clear()
+    if preloaded_registry is None:
+        app.state.registry.clear()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.state.metrics = ServiceMetrics()
 
 # Add CORS middleware
 app.add_middleware(
@@ -13,6 +150,124 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# Everything a segmentation handler needs for one request
+SegmentationContext = namedtuple(
+    "SegmentationContext", ["segmenter", "model_id", "word_cache", "coalescer", "executor", "metrics", "deadline"]
+)
+
+
+class SegmentRequest(BaseModel):
+    texts: List[str]
+    output_string: bool = False
+    delimiter: str = " @@"
+
+
+def _route_name(request: Request) -> str:
+    # Label requests by route template rather than raw path, so /seg_list/{string} is a single series
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    metrics = request.app.state.metrics
+    route = _route_name(request)
+    start = time.perf_counter()
+    status = 500
+    metrics.in_flight.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.in_flight.dec()
+        metrics.observe_request(request.method, route, status, time.perf_counter() - start)
+
+
+def get_registry(request: Request) -> ModelRegistry:
+    registry = request.app.state.registry
+    if not registry.is_ready():
+        raise HTTPException(status_code=503, detail="Models are still loading.", headers={"Retry-After": "5"})
+    return registry
+
+
+def get_word_cache(request: Request) -> LRUCache:
+    return request.app.state.word_cache
+
+
+def get_metrics(request: Request) -> ServiceMetrics:
+    return request.app.state.metrics
+
+
+def get_lang(lang: str = DEFAULT_LANG, registry: ModelRegistry = Depends(get_registry)) -> str:
+    if lang not in registry:
+        raise HTTPException(status_code=404, detail=f"No model loaded for language '{lang}'.")
+    return lang
+
+
+def get_deadline(request: Request) -> float:
+    # Clients may shorten (or extend) the default time budget of a request with the X-Request-Timeout header
+    try:
+        timeout = float(request.headers.get("x-request-timeout", REQUEST_TIMEOUT))
+    except ValueError:
+        timeout = math.nan
+    if not math.isfinite(timeout) or timeout <= 0:
+        raise HTTPException(status_code=400, detail="X-Request-Timeout must be a positive number of seconds.")
+    return time.monotonic() + timeout
+
+
+def get_context(request: Request, lang: str = Depends(get_lang), registry: ModelRegistry = Depends(get_registry),
+                deadline: float = Depends(get_deadline)) -> SegmentationContext:
+    # The request keeps this model until it is done, even if a reload swaps in a new one meanwhile
+    model = registry.model(lang)
+    return SegmentationContext(
+        segmenter=model.segmenter, model_id=model.fingerprint, word_cache=request.app.state.word_cache,
+        coalescer=request.app.state.coalescer, executor=request.app.state.executor, metrics=request.app.state.metrics,
+        deadline=deadline
+    )
+
+
+def require_admin(x_admin_token: str = Header(default="")) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set MORPHSEG_ADMIN_TOKEN.")
+    if not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+
+
+async def _segment(context: SegmentationContext, texts: List[str], output_string: bool = False,
+                   delimiter: str = " @@") -> list:
+    return await context.executor.run(
+        segment_texts, context.segmenter, texts, output_string=output_string, delimiter=delimiter,
+        cache=context.word_cache, model_id=context.model_id, metrics=context.metrics, coalescer=context.coalescer,
+        words=count_words(texts), deadline=context.deadline
+    )
+
+
+def _etag(model_id: str, *parts: str) -> str:
+    # Responses are a pure function of the model and the request, so the ETag can be computed before any inference
+    digest = hashlib.sha256("\x00".join((model_id,) + parts).encode("utf-8")).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def _cache_headers(etag: str) -> dict:
+    # Models can be hot reloaded, so clients and proxies revalidate every time. The ETag changes with the model
+    # fingerprint, and a matching If-None-Match is answered with a 304 before any inference
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+@app.exception_handler(Overloaded)
+@app.exception_handler(DeadlineExceeded)
+async def shed_load(request: Request, exc: Exception):
+    # Fail fast instead of letting work pile up, so accepted requests keep a bounded latency
+    request.app.state.metrics.observe_shed(type(exc).__name__)
+    retry_after = getattr(exc, "retry_after", RETRY_AFTER)
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(retry_after)})
+
+
 @app.get("/")
 async def root():
     return {"message": "success, is that all you got?"}
@@ -23,17 +278,135 @@ async def health():
     return {"message": "healthy"}
 
 
+@app.get("/ready")
+async def ready(request: Request):
+    registry = request.app.state.registry
+    loading = request.app.state.loading
+    body = {"ready": registry.is_ready(), "models": registry.status(), "draining": registry.draining()}
+    if loading.done() and not loading.cancelled() and loading.exception() is not None:
+        body["error"] = repr(loading.exception())
+    return JSONResponse(content=body, status_code=200 if body["ready"] else 503)
+
+
+@app.post("/admin/reload", dependencies=[Depends(require_admin)])
+async def reload_model(request: Request, lang: str = DEFAULT_LANG):
+    # Reloads the configured checkpoint of `lang` in this process. Behind serve.py every worker holds its own
+    # models, so use MORPHSEG_RELOAD_POLL_INTERVAL there to reload all of them
+    registry = request.app.state.registry
+    if lang not in registry.langs:
+        raise HTTPException(status_code=404, detail=f"No model configured for language '{lang}'.")
+    if not request.app.state.loading.done():
+        raise HTTPException(status_code=503, detail="Models are still loading.", headers={"Retry-After": "5"})
+    previous = registry.fingerprint(lang) if lang in registry else None
+    try:
+        fingerprint = await _reload_model(request.app, lang)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving the previous model: {exc!r}")
+    return {"lang": lang, "previous_fingerprint": previous, "fingerprint": fingerprint,
+            "draining": registry.draining()}
+
+
+@app.get("/metrics")
+async def metrics_endpoint(metrics: ServiceMetrics = Depends(get_metrics)):
+    return Response(content=metrics.render(), media_type=metrics.content_type)
+
+
+@app.get("/cache")
+async def cache_stats(request: Request, word_cache: LRUCache = Depends(get_word_cache)):
+    return {**word_cache.stats(), 'coalescing': request.app.state.coalescer.stats()}
+
+
 @app.get("/seg_list/{string}")
-async def seg_list(string: str):
-    morpheme_segmenter = MorphemeSegmenter(lang="eng", train_from_scratch=False)
-    segments = morpheme_segmenter.segment(string, output_string=False)
-    print(segments)
+async def seg_list(string: str, request: Request, response: Response,
+                   context: SegmentationContext = Depends(get_context)):
+    etag = _etag(context.model_id, "seg_list", string)
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    response.headers.update(_cache_headers(etag))
+    segments, = await _segment(context, [string], output_string=False)
     return {"message": segments}
 
 
 @app.get("/seg_string/{string}")
-async def seg_string(string: str):
-    morpheme_segmenter = MorphemeSegmenter(lang="eng", train_from_scratch=False)
-    segments = morpheme_segmenter.segment(string, output_string=True)
-    print(segments)
+async def seg_string(string: str, request: Request, response: Response,
+                     context: SegmentationContext = Depends(get_context)):
+    etag = _etag(context.model_id, "seg_string", string)
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    response.headers.update(_cache_headers(etag))
+    segments, = await _segment(context, [string], output_string=True)
+    return {"message": segments}
+
+
+@app.post("/segment")
+async def segment(request: SegmentRequest, context: SegmentationContext = Depends(get_context)):
+    segments = await _segment(
+        context, request.texts, output_string=request.output_string, delimiter=request.delimiter
+    )
     return {"message": segments}
+
+
+@app.post("/segment_stream")
+async def segment_stream(request: Request, output_string: bool = False, delimiter: str = " @@",
+                         context: SegmentationContext = Depends(get_context)):
+    records = stream_segmentations(
+        context.segmenter, request.stream(), context.executor, chunk_words=STREAM_CHUNK_WORDS,
+        output_string=output_string, delimiter=delimiter, cache=context.word_cache, model_id=context.model_id,
+        metrics=context.metrics, coalescer=context.coalescer
+    )
+    return NDJSONResponse(records)
+
+
+@app.post("/segment_stream/upload")
+async def segment_stream_upload(file: UploadFile, output_string: bool = False, delimiter: str = " @@",
+                                context: SegmentationContext = Depends(get_context)):
+    records = stream_segmentations(
+        context.segmenter, iter_upload(file), context.executor, chunk_words=STREAM_CHUNK_WORDS,
+        output_string=output_string, delimiter=delimiter, cache=context.word_cache, model_id=context.model_id,
+        metrics=context.metrics, coalescer=context.coalescer
+    )
+    return NDJSONResponse(records)
+
+
+@app.websocket("/ws/segment")
+async def segment_incremental(websocket: WebSocket, lang: str = DEFAULT_LANG, delimiter: str = " @@"):
+    # Each message is {"text": ...} with the full current text, each reply is the delta against the previous text
+    await websocket.accept()
+    state = websocket.app.state
+    if not state.registry.is_ready():
+        await websocket.close(code=1013, reason="Models are still loading.")
+        return
+    if lang not in state.registry:
+        await websocket.close(code=1008, reason=f"No model loaded for language '{lang}'.")
+        return
+
+    model = state.registry.model(lang)
+    session = IncrementalSession(
+        model.segmenter, delimiter=delimiter, cache=state.word_cache, model_id=model.fingerprint,
+        metrics=state.metrics, coalescer=state.coalescer
+    )
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                # Frames that aren't JSON get the same reply as JSON without a text field
+                message = None
+            # Move long lived sessions to a reloaded model, so they don't keep the old one alive
+            model = state.registry.model(lang)
+            session.segmenter, session.model_id = model.segmenter, model.fingerprint
+            text = message.get("text") if isinstance(message, dict) else None
+            if not isinstance(text, str):
+                await websocket.send_json({"error": "Messages must be objects with a string 'text' field."})
+                continue
+            try:
+                delta = await state.executor.run(
+                    session.update, text, words=count_words([text]), deadline=time.monotonic() + REQUEST_TIMEOUT
+                )
+            except (Overloaded, DeadlineExceeded) as exc:
+                state.metrics.observe_shed(type(exc).__name__)
+                await websocket.send_json({"error": str(exc), "retry_after": RETRY_AFTER})
+                continue
+            await websocket.send_json(delta)
+    except WebSocketDisconnect:
+        pass
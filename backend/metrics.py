@@ -0,0 +1,90 @@
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import CONTENT_TYPE_LATEST
+from testmorphseg.utils.cache import LRUCache
+
+from coalesce import WordCoalescer
+from executor import InferenceExecutor
+
+# Stages of a segmentation call, in pipeline order
+STAGES = ["tokenize", "collate", "forward", "decode", "rules2sent"]
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+WORD_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class ServiceMetrics:
+    """Prometheus metrics of the segmentation service, kept in their own registry"""
+    content_type = CONTENT_TYPE_LATEST
+
+    def __init__(self) -> None:
+        self.registry = CollectorRegistry()
+        self.requests = Counter(
+            "morphseg_requests_total", "Handled HTTP requests", ["method", "route", "status"], registry=self.registry
+        )
+        self.in_flight = Gauge(
+            "morphseg_requests_in_flight", "HTTP requests currently being handled", registry=self.registry
+        )
+        self.request_latency = Histogram(
+            "morphseg_request_seconds", "End to end HTTP request latency", ["route"],
+            buckets=LATENCY_BUCKETS, registry=self.registry
+        )
+        self.request_words = Histogram(
+            "morphseg_request_words", "Words segmented per request", buckets=WORD_BUCKETS, registry=self.registry
+        )
+        self.stage_latency = Histogram(
+            "morphseg_stage_seconds", "Latency of each segmentation stage", ["stage"],
+            buckets=LATENCY_BUCKETS, registry=self.registry
+        )
+        for stage in STAGES:
+            self.stage_latency.labels(stage=stage)
+        self.shed = Counter(
+            "morphseg_shed_total", "Requests rejected by admission control", ["reason"], registry=self.registry
+        )
+        self.reloads = Counter(
+            "morphseg_model_reloads_total", "Model hot reloads", ["lang", "result"], registry=self.registry
+        )
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        self.stage_latency.labels(stage=stage).observe(seconds)
+
+    def observe_words(self, count: int) -> None:
+        self.request_words.observe(count)
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float) -> None:
+        self.requests.labels(method=method, route=route, status=str(status)).inc()
+        self.request_latency.labels(route=route).observe(seconds)
+
+    def observe_shed(self, reason: str) -> None:
+        self.shed.labels(reason=reason).inc()
+
+    def observe_reload(self, lang: str, result: str) -> None:
+        self.reloads.labels(lang=lang, result=result).inc()
+
+    def track_executor(self, executor: InferenceExecutor) -> None:
+        jobs = Gauge("morphseg_inference_jobs", "Inference jobs running or queued", registry=self.registry)
+        words = Gauge("morphseg_inference_queued_words", "Words admitted and not yet done", registry=self.registry)
+        jobs.set_function(lambda: executor.jobs)
+        words.set_function(lambda: executor.queued_words)
+
+    def track_word_cache(self, cache: LRUCache) -> None:
+        hits = Gauge("morphseg_word_cache_hits", "Word cache hits", registry=self.registry)
+        misses = Gauge("morphseg_word_cache_misses", "Word cache misses", registry=self.registry)
+        size = Gauge("morphseg_word_cache_size", "Words held in the word cache", registry=self.registry)
+        hits.set_function(lambda: cache.hits)
+        misses.set_function(lambda: cache.misses)
+        size.set_function(lambda: len(cache))
+
+    def track_coalescer(self, coalescer: WordCoalescer) -> None:
+        predicted = Gauge("morphseg_coalescer_predicted_words", "Words predicted by their first caller",
+                          registry=self.registry)
+        coalesced = Gauge("morphseg_coalescer_coalesced_words",
+                          "Words served by waiting on a concurrent prediction instead of predicting again",
+                          registry=self.registry)
+        in_flight = Gauge("morphseg_coalescer_in_flight_words", "Words currently being predicted",
+                          registry=self.registry)
+        predicted.set_function(lambda: coalescer.predicted)
+        coalesced.set_function(lambda: coalescer.coalesced)
+        in_flight.set_function(lambda: len(coalescer))
+
+    def render(self) -> bytes:
+        return generate_latest(self.registry)
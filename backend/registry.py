@@ -0,0 +1,175 @@
+import os
+import threading
+import weakref
+from collections import namedtuple
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from testmorphseg import MorphemeSegmenter
+from testmorphseg.training.trainer import model_fingerprint as checkpoint_fingerprint
+
+# Labellers are told apart by their attributes, not with isinstance: the segmenter builds them from the library's
+# own module path, so their classes aren't the ones this module would import from `testmorphseg`
+
+
+def model_fingerprint(segmenter: MorphemeSegmenter) -> str:
+    """Short content hash of a segmenter's model, used to tell models apart in cache keys and ETags"""
+    sequence_labeller = segmenter.sequence_labeller
+    # Exported artifacts store the fingerprint of the checkpoint they were exported from
+    if hasattr(sequence_labeller, "fingerprint"):
+        return sequence_labeller.fingerprint
+    return checkpoint_fingerprint(sequence_labeller.model)
+
+
+def _torch_module(segmenter: MorphemeSegmenter):
+    # Module holding the weights, None for labellers that don't run on torch (NumPy artifacts)
+    sequence_labeller = segmenter.sequence_labeller
+    if hasattr(sequence_labeller, "graph"):
+        return sequence_labeller.graph
+    if hasattr(sequence_labeller, "model"):
+        return sequence_labeller.model.model
+    return None
+
+
+# A segmenter together with the fingerprint of its weights. Both are swapped as one object on reload,
+# so a request can never pair a new model with the cache keys of the old one
+LoadedModel = namedtuple("LoadedModel", ["segmenter", "fingerprint"])
+
+
+def _warm(segmenter: MorphemeSegmenter, sources: List[List[str]], batch_sizes: List[int]) -> None:
+    if sources:
+        for batch_size in batch_sizes:
+            batch = [sources[i % len(sources)] for i in range(batch_size)]
+            segmenter.sequence_labeller.predict(sources=batch)
+
+
+class ModelRegistry:
+    """
+    Holds one loaded MorphemeSegmenter per language for the lifetime of the process.
+    Models are loaded and warmed up once at startup and shared by every request. A language's model can be
+    replaced at runtime with `reload`, requests that already hold the old model finish on it.
+    """
+    def __init__(self, langs: Iterable[str], stage_timer: Optional[Callable[[str, float], None]] = None,
+                 model_paths: Optional[Dict[str, str]] = None) -> None:
+        self.langs = list(langs)
+        self.stage_timer = stage_timer
+        # Checkpoint per language, languages without one use the pretrained model shipped with the library
+        self.model_paths = dict(model_paths or {})
+        self._models: Dict[str, LoadedModel] = {}
+        self._warm: Set[str] = set()
+        self._retired: List[weakref.ref] = []
+        self._reload_lock = threading.Lock()
+
+    def _load_model(self, lang: str) -> LoadedModel:
+        # The stage timer is only attached once the model is warm, warmup batches aren't requests and would
+        # skew the stage timings
+        segmenter = MorphemeSegmenter(lang=lang, model_path=self.model_paths.get(lang), train_from_scratch=False)
+        if segmenter.sequence_labeller is None:
+            raise RuntimeError(
+                f"No model for language '{lang}': it has no pretrained model, set a checkpoint for it in "
+                f"MORPHSEG_MODEL_PATHS, e.g. '{lang}=/models/{lang}.pt'."
+            )
+        return LoadedModel(segmenter=segmenter, fingerprint=model_fingerprint(segmenter))
+
+    def load(self) -> "ModelRegistry":
+        for lang in self.langs:
+            self._models[lang] = self._load_model(lang)
+        return self
+
+    def is_loaded(self) -> bool:
+        return all(lang in self._models for lang in self.langs)
+
+    def set_stage_timer(self, stage_timer: Optional[Callable[[str, float], None]]) -> None:
+        self.stage_timer = stage_timer
+        for lang, model in self._models.items():
+            if lang in self._warm:
+                model.segmenter.sequence_labeller.stage_timer = stage_timer
+
+    def share_memory(self) -> "ModelRegistry":
+        # Move all weights into shared memory, so processes forked afterwards map the same pages
+        # instead of each holding a private copy. NumPy arrays are inherited copy-on-write anyway
+        for model in self._models.values():
+            module = _torch_module(model.segmenter)
+            if module is not None:
+                module.eval().share_memory()
+        return self
+
+    def warmup(self, words: List[str], batch_sizes: List[int]) -> "ModelRegistry":
+        # Run real batches of each shape through every model, so allocator growth and kernel selection
+        # happen now instead of during the first user requests
+        sources = [list(word.lower()) for word in words]
+        for lang, model in self._models.items():
+            _warm(model.segmenter, sources, batch_sizes)
+            model.segmenter.sequence_labeller.stage_timer = self.stage_timer
+            self._warm.add(lang)
+        return self
+
+    def reload(self, lang: str, words: List[str], batch_sizes: List[int]) -> LoadedModel:
+        """
+        Load the checkpoint of `lang` again, warm the new model up and swap it in. Blocks until done, so it
+        should run off the event loop. The old model is only dropped from the registry, requests already
+        using it keep their reference and it is freed once the last of them is done.
+        """
+        if lang not in self.langs:
+            raise KeyError(f"No model configured for language '{lang}'.")
+        # One reload at a time, concurrent reloads would only compete for the CPU serving requests
+        with self._reload_lock:
+            model = self._load_model(lang)
+            module = _torch_module(model.segmenter)
+            if module is not None:
+                module.eval()
+            _warm(model.segmenter, [list(word.lower()) for word in words], batch_sizes)
+            model.segmenter.sequence_labeller.stage_timer = self.stage_timer
+            previous = self._models.get(lang)
+            # A single dict assignment, readers see either the old or the new model, never a mix
+            self._models[lang] = model
+            self._warm.add(lang)
+            if previous is not None:
+                self._retired.append(weakref.ref(previous.segmenter))
+        return model
+
+    def draining(self) -> int:
+        """Number of replaced models still referenced by in-flight requests"""
+        self._retired = [ref for ref in self._retired if ref() is not None]
+        return len(self._retired)
+
+    def checkpoint_mtimes(self) -> Dict[str, float]:
+        mtimes = {}
+        for lang, path in self.model_paths.items():
+            try:
+                mtimes[lang] = os.stat(path).st_mtime
+            except OSError:
+                continue
+        return mtimes
+
+    def status(self) -> Dict[str, dict]:
+        return {
+            lang: {
+                'loaded': lang in self._models,
+                'warm': lang in self._warm,
+                'fingerprint': self._models[lang].fingerprint if lang in self._models else None,
+            }
+            for lang in self.langs
+        }
+
+    def is_ready(self) -> bool:
+        return all(lang in self._warm for lang in self.langs)
+
+    def model(self, lang: str) -> LoadedModel:
+        try:
+            return self._models[lang]
+        except KeyError:
+            raise KeyError(f"No model loaded for language '{lang}'.")
+
+    def get(self, lang: str) -> MorphemeSegmenter:
+        return self.model(lang).segmenter
+
+    def fingerprint(self, lang: str) -> str:
+        return self.model(lang).fingerprint
+
+    def __contains__(self, lang: str) -> bool:
+        return lang in self._models
+
+    def clear(self) -> None:
+        self._models.clear()
+        self._warm.clear()
+        self._retired.clear()
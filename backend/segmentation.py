@@ -0,0 +1,110 @@
+import re
+import time
+from typing import Dict, List, Optional, Union
+
+from testmorphseg import MorphemeSegmenter
+from testmorphseg.utils.actions import rules2sent
+from testmorphseg.utils.cache import LRUCache
+
+from coalesce import WordCoalescer
+from metrics import ServiceMetrics
+
+# Same word pattern as MorphemeSegmenter.segment, so batched results match the single text endpoints
+WORD_PATTERN = re.compile(r"[a-zA-Z'-]+")
+
+Segmentation = Union[str, List[List[str]]]
+
+
+def count_words(texts: List[str]) -> int:
+    return sum(1 for text in texts for _ in WORD_PATTERN.finditer(text))
+
+
+def split_segmentation(segmentation: str, delimiter: str) -> List[str]:
+    if delimiter == "":
+        return [char for char in segmentation]
+    return segmentation.split(delimiter)
+
+
+def format_segmentation(text: str, segmentations: List[str], output_string: bool, delimiter: str) -> Segmentation:
+    """Shape the segmented words of one text like MorphemeSegmenter.segment does"""
+    if text == "":
+        return []
+    if output_string:
+        # Replace each word match with the next segmented word
+        word_iter = iter(segmentations)
+        return WORD_PATTERN.sub(lambda m: next(word_iter), text)
+    return [split_segmentation(word, delimiter) for word in segmentations]
+
+
+def _predict(segmenter: MorphemeSegmenter, keys: List[tuple], delimiter: str,
+             metrics: Optional[ServiceMetrics]) -> Dict[tuple, str]:
+    sources = [list(word) for _, _, word in keys]
+    predictions = segmenter.sequence_labeller.predict(sources=sources)
+    start = time.perf_counter()
+    predicted = {
+        key: rules2sent(source=source, actions=prediction.prediction).replace(" @@", delimiter)
+        for key, source, prediction in zip(keys, sources, predictions)
+    }
+    if metrics is not None:
+        metrics.observe_stage("rules2sent", time.perf_counter() - start)
+    return predicted
+
+
+def segment_words(segmenter: MorphemeSegmenter, words: List[str], delimiter: str = " @@",
+                  cache: Optional[LRUCache] = None, model_id: str = "",
+                  metrics: Optional[ServiceMetrics] = None, coalescer: Optional[WordCoalescer] = None) -> List[str]:
+    """
+    Segment lowercased words, returning one delimited segmentation per word.
+    Cached words skip the model and every distinct uncached word is predicted once. With a coalescer, words that
+    a concurrent call is already predicting are awaited instead of predicted again.
+    """
+    keys = [(model_id, delimiter, word) for word in words]
+    known = cache.get_many(set(keys)) if cache is not None else dict()
+
+    missing = list(dict.fromkeys(key for key in keys if key not in known))
+    owned, waiting = coalescer.claim(missing) if coalescer is not None else (missing, {})
+    if owned:
+        try:
+            predicted = _predict(segmenter, owned, delimiter, metrics)
+        except BaseException as exc:
+            if coalescer is not None:
+                coalescer.fail(owned, exc)
+            raise
+        # Cache before resolving, so a call missing the cache from now on finds the word there
+        if cache is not None:
+            cache.put_many(predicted)
+        if coalescer is not None:
+            coalescer.resolve(predicted)
+        known.update(predicted)
+    for key, future in waiting.items():
+        known[key] = future.result()
+
+    return [known[key] for key in keys]
+
+
+def segment_texts(segmenter: MorphemeSegmenter, texts: List[str], output_string: bool = False,
+                  delimiter: str = " @@", cache: Optional[LRUCache] = None, model_id: str = "",
+                  metrics: Optional[ServiceMetrics] = None, coalescer: Optional[WordCoalescer] = None,
+                  count_words: bool = True) -> List[Segmentation]:
+    """Segment many texts with a single SequenceLabeller.predict pass over all of their words"""
+    start = time.perf_counter()
+    words_per_text = [WORD_PATTERN.findall(text) for text in texts]
+    words = [word.lower() for text_words in words_per_text for word in text_words]
+    if metrics is not None:
+        metrics.observe_stage("tokenize", time.perf_counter() - start)
+        if count_words:
+            metrics.observe_words(len(words))
+
+    segmentations = segment_words(
+        segmenter, words, delimiter=delimiter, cache=cache, model_id=model_id, metrics=metrics, coalescer=coalescer
+    )
+
+    # Split the flat list of segmented words back into one entry per text
+    results = []
+    offset = 0
+    for text, text_words in zip(texts, words_per_text):
+        text_segmentations = segmentations[offset:offset + len(text_words)]
+        offset += len(text_words)
+        results.append(format_segmentation(text, text_segmentations, output_string, delimiter))
+
+    return results
@@ -0,0 +1,112 @@
+"""
+Pre-fork server for running several backend workers on one machine.
+
+The master process loads every model once and moves the weights into shared memory, then forks the workers.
+Workers inherit the weight pages instead of each calling torch.load, so memory no longer grows with the number
+of workers. Each worker gets an equal share of the cores for its torch threads.
+
+Usage:
+    python serve.py --host 0.0.0.0 --port 8000 --workers 4
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+
+logger = logging.getLogger("serve")
+
+
+def _bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, log_level: str) -> None:
+    import uvicorn
+    import main
+
+    # Restore default signal handling, uvicorn installs its own handlers for a graceful shutdown
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    server = uvicorn.Server(uvicorn.Config(main.app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+def _fork_worker(sock: socket.socket, log_level: str) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _run_worker(sock, log_level)
+        except Exception:
+            logger.exception("Worker %d crashed", os.getpid())
+            os._exit(1)
+        os._exit(0)
+    return pid
+
+
+def run(host: str, port: int, workers: int, log_level: str = "info", backlog: int = 2048) -> None:
+    cores = os.cpu_count() or 1
+    # Must be set before `main` is imported, it reads its configuration at import time
+    os.environ["MORPHSEG_CPU_BUDGET"] = str(max(1, cores // workers))
+
+    import torch
+    import main
+    from registry import ModelRegistry
+
+    # Keep the master single threaded: an OpenMP pool created before fork() is unusable in the children.
+    # Workers pick their own thread count in the app lifespan and warm the shared models up themselves.
+    torch.set_num_threads(1)
+    registry = ModelRegistry(langs=main.MORPHSEG_LANGS, model_paths=main.MODEL_PATHS)
+    main.preloaded_registry = registry.load().share_memory()
+
+    sock = _bind_socket(host, port, backlog)
+    children = {_fork_worker(sock, log_level) for _ in range(workers)}
+    shutting_down = False
+
+    def stop(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info("Serving on %s:%d with %d workers, %s cores each", host, port, workers,
+                os.environ["MORPHSEG_CPU_BUDGET"])
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        # Replace workers that died unexpectedly, they inherit the same shared weights
+        if not shutting_down:
+            logger.warning("Worker %d exited with status %d, starting a replacement", pid, status)
+            children.add(_fork_worker(sock, log_level))
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the MorphSeg backend with pre-forked workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        sys.exit("--workers must be at least 1")
+    # Workers inherit this configuration, uvicorn only configures its own loggers
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s:     %(name)s - %(message)s")
+    run(host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
@@ -0,0 +1,115 @@
+import codecs
+import json
+from typing import AsyncIterator, Optional, Tuple
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from testmorphseg import MorphemeSegmenter
+from testmorphseg.utils.cache import LRUCache
+
+from coalesce import WordCoalescer
+from executor import DeadlineExceeded, InferenceExecutor, Overloaded
+from metrics import ServiceMetrics
+from segmentation import WORD_PATTERN, segment_texts
+
+
+class NDJSONResponse(StreamingResponse):
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # The records are produced while the request body is still being read from `receive`, so unlike
+        # StreamingResponse this must not consume `receive` to listen for a client disconnect
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+def take_words(buffer: str, max_words: int, final: bool, max_chars: int) -> Tuple[Optional[str], str, int]:
+    """
+    Split the longest prefix of `buffer` holding at most `max_words` complete words off the buffer,
+    returning the prefix, the rest of the buffer and the number of words in the prefix.
+    Unless `final` is set, a word touching the end of the buffer may continue in the next chunk and is held back,
+    and nothing is returned until `max_words` complete words are available or the buffer grows past `max_chars`.
+    """
+    count = 0
+    end = 0
+    for match in WORD_PATTERN.finditer(buffer):
+        if match.end() == len(buffer) and not final:
+            break
+        count += 1
+        end = match.end()
+        if count == max_words:
+            return buffer[:end], buffer[end:], count
+
+    if final:
+        return buffer, "", count
+    if len(buffer) > max_chars:
+        # Text with few words must not pile up and be rescanned on every chunk: flush it, holding back only a
+        # trailing partial word. A single word longer than `max_chars` is split
+        trailing = WORD_PATTERN.search(buffer, end)
+        cut = trailing.start() if trailing is not None and trailing.end() == len(buffer) else len(buffer)
+        if cut == 0:
+            cut = len(buffer)
+            count += 1
+        # Admission control and the metrics count every flushed prefix as at least one word
+        return buffer[:cut], buffer[cut:], max(count, 1)
+    return None, buffer, 0
+
+
+async def iter_upload(upload, read_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    while True:
+        data = await upload.read(read_size)
+        if not data:
+            break
+        yield data
+
+
+async def stream_segmentations(segmenter: MorphemeSegmenter, chunks: AsyncIterator[bytes],
+                               executor: InferenceExecutor, chunk_words: int, output_string: bool = False,
+                               delimiter: str = " @@", cache: Optional[LRUCache] = None, model_id: str = "",
+                               metrics: Optional[ServiceMetrics] = None,
+                               coalescer: Optional[WordCoalescer] = None) -> AsyncIterator[str]:
+    """
+    Segment a UTF-8 byte stream, yielding one NDJSON record per `chunk_words` words as soon as each
+    inference batch finishes. Only the current chunk of text is held in memory.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    # Records of text with few words are cut at this many characters instead
+    max_chars = max(64 * 1024, 64 * chunk_words)
+    buffer = ""
+    index = 0
+    total_words = 0
+
+    async def process(piece: str, num_words: int) -> str:
+        segments, = await executor.run(
+            segment_texts, segmenter, [piece], output_string=output_string, delimiter=delimiter,
+            cache=cache, model_id=model_id, metrics=metrics, coalescer=coalescer, count_words=False, words=num_words
+        )
+        return json.dumps({"index": index, "message": segments}) + "\n"
+
+    try:
+        async for data in chunks:
+            buffer += decoder.decode(data)
+            piece, buffer, num_words = take_words(buffer, chunk_words, final=False, max_chars=max_chars)
+            while piece is not None:
+                yield await process(piece, num_words)
+                index += 1
+                total_words += num_words
+                piece, buffer, num_words = take_words(buffer, chunk_words, final=False, max_chars=max_chars)
+
+        buffer += decoder.decode(b"", final=True)
+        while buffer:
+            piece, buffer, num_words = take_words(buffer, chunk_words, final=True, max_chars=max_chars)
+            yield await process(piece, num_words)
+            index += 1
+            total_words += num_words
+    except (Overloaded, DeadlineExceeded) as exc:
+        # Headers are already sent, so shedding mid-stream ends the stream with an error record
+        if metrics is not None:
+            metrics.observe_shed(type(exc).__name__)
+        yield json.dumps({"index": index, "error": str(exc)}) + "\n"
+        return
+
+    # The whole stream is one request, so its words are counted once at the end
+    if metrics is not None:
+        metrics.observe_words(total_words)
@@ -0,0 +1,48 @@
+"""
+Loads the checkpoint shipped with the library through ModelRegistry. Run from this directory, with the library
+installed from requirements.txt and the repository root on PYTHONPATH:
+    PYTHONPATH=.. python -m unittest test_registry
+"""
+import unittest
+
+import torch
+
+from registry import ModelRegistry, model_fingerprint
+
+WORDS = ["unbelievably", "disagreeable"]
+
+
+class ModelRegistryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.registry = ModelRegistry(langs=["cs"]).load()
+
+    def test_fingerprint(self):
+        fingerprint = self.registry.fingerprint("cs")
+        self.assertEqual(len(fingerprint), 16)
+        self.assertEqual(fingerprint, model_fingerprint(self.registry.get("cs")))
+
+    def test_share_memory(self):
+        self.registry.share_memory()
+        module = self.registry.get("cs").sequence_labeller.model.model
+        self.assertFalse(module.training)
+        self.assertTrue(all(parameter.is_shared() for parameter in module.parameters()))
+
+    def test_warmup_and_reload(self):
+        self.registry.warmup(WORDS, batch_sizes=[1, 2])
+        self.assertTrue(self.registry.is_ready())
+        expected = self.registry.get("cs").segment(" ".join(WORDS))
+        model = self.registry.reload("cs", WORDS, batch_sizes=[1])
+        self.assertIs(self.registry.get("cs"), model.segmenter)
+        self.assertFalse(model.segmenter.sequence_labeller.model.model.training)
+        self.assertEqual(model.fingerprint, self.registry.fingerprint("cs"))
+        self.assertEqual(model.segmenter.segment(" ".join(WORDS)), expected)
+
+    def test_language_without_model(self):
+        with self.assertRaisesRegex(RuntimeError, "MORPHSEG_MODEL_PATHS"):
+            ModelRegistry(langs=["en"]).load()
+
+
+if __name__ == "__main__":
+    torch.set_num_threads(1)
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+Check and benchmark the NumPy inference backend against the torch model.
+
+Exports the checkpoint with `MorphemeSegmenter.export(format="numpy")`, then reports:
+- parity: the largest logit difference, and the share of words whose predicted actions match the torch path;
+- cold start: the median time a fresh interpreter takes to import, load the model and segment one word;
+- the median latency of segmenting one word at a time, and the throughput of one call over all test words.
+Cold start, latency and throughput go through `MorphemeSegmenter.segment` and `segment_batch` for both backends,
+so they include the same word extraction and output formatting.
+
+Usage (from the repository root):
+    python library/benchmark_numpy.py --lang cs --data library/data/cs/test.tsv
+    python library/benchmark_numpy.py --lang cs --model-path my_model.pt --save-dir exported/
+Without --model-path the pretrained model of --lang is used, see `PRETRAINED_MODELS` in `morpheme_segmenter`.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import contextlib
+import subprocess
+
+import numpy as np
+import torch
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from library.testmorphseg.interface.morpheme_segmenter import MorphemeSegmenter
+from library.testmorphseg.interface.numpy_labeller import NumpySequenceLabeller
+
+COLD_START = {
+    "torch": """
+from library.testmorphseg.interface.morpheme_segmenter import MorphemeSegmenter
+segmenter = MorphemeSegmenter({lang!r}, model_path={model_path!r})
+segmenter.segment("segmentation")
+""",
+    "numpy": """
+from library.testmorphseg.interface.morpheme_segmenter import MorphemeSegmenter
+segmenter = MorphemeSegmenter({lang!r}, model_path={npz_path!r})
+segmenter.segment("segmentation")
+""",
+}
+
+TIMER = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+{statement}
+print(json.dumps({{"seconds": time.perf_counter() - start, "torch_loaded": "torch" in sys.modules}}))
+"""
+
+
+def _cold_start(statement: str, runs: int) -> dict:
+    samples = []
+    torch_loaded = False
+    statement = "\n".join("    " + line for line in statement.strip().splitlines())
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", TIMER.format(statement=statement)],
+            cwd=REPO_ROOT, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        samples.append(result["seconds"])
+        torch_loaded = torch_loaded or result["torch_loaded"]
+    return {'median_seconds': statistics.median(samples), 'torch_loaded': torch_loaded}
+
+
+def _per_word_ms(segmenter: MorphemeSegmenter, words) -> float:
+    samples = []
+    for word in words:
+        start = time.perf_counter()
+        segmenter.segment(word)
+        samples.append(time.perf_counter() - start)
+    return 1000 * statistics.median(samples)
+
+
+def _throughput(segmenter: MorphemeSegmenter, words) -> float:
+    start = time.perf_counter()
+    segmenter.segment_batch(words)
+    return len(words) / (time.perf_counter() - start)
+
+
+def _max_logit_difference(segmenter: MorphemeSegmenter, labeller: NumpySequenceLabeller, sources) -> float:
+    inputs, lengths = labeller._collate(sources)
+    with torch.no_grad():
+        expected = segmenter.sequence_labeller.model.model(
+            inputs=torch.from_numpy(inputs), lengths=torch.from_numpy(lengths)
+        ).numpy()
+    return float(np.abs(labeller.logits(inputs, lengths) - expected).max())
+
+
+def benchmark(lang: str, data: str, save_dir: str, model_path=None, latency_words: int = 200, runs: int = 3,
+              threads=None) -> dict:
+    if threads is not None:
+        torch.set_num_threads(threads)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        segmenter = MorphemeSegmenter(lang, model_path=model_path)
+        segmenter.device = torch.device("cpu")
+        segmenter.sequence_labeller.settings.device = segmenter.device
+        sources = segmenter._load_data(data).sources
+    npz_path = segmenter.export(save_dir, name=lang, format="numpy")
+    with contextlib.redirect_stdout(io.StringIO()):
+        numpy_segmenter = MorphemeSegmenter(lang, model_path=npz_path)
+    labeller = numpy_segmenter.sequence_labeller
+
+    with contextlib.redirect_stderr(io.StringIO()):
+        torch_actions = [prediction.prediction for prediction in segmenter.sequence_labeller.predict(sources)]
+    numpy_actions = [prediction.prediction for prediction in labeller.predict(sources)]
+    matches = sum(expected == actual for expected, actual in zip(torch_actions, numpy_actions))
+
+    latency_sources = sources[:latency_words]
+    words = ["".join(source) for source in sources]
+    results = {
+        'lang': lang,
+        'data': os.path.abspath(data),
+        'num_words': len(sources),
+        'threads': torch.get_num_threads(),
+        'npz_path': npz_path,
+        'npz_bytes': os.path.getsize(npz_path),
+        'max_logit_difference': _max_logit_difference(segmenter, labeller, latency_sources),
+        'matching_predictions': matches / len(sources),
+    }
+    for backend, backend_segmenter in (("torch", segmenter), ("numpy", numpy_segmenter)):
+        with contextlib.redirect_stderr(io.StringIO()):
+            results[backend] = {
+                'cold_start': _cold_start(
+                    COLD_START[backend].format(lang=lang, model_path=model_path, npz_path=npz_path), runs
+                ),
+                'per_word_ms': _per_word_ms(backend_segmenter, words[:latency_words]),
+                'words_per_second': max(_throughput(backend_segmenter, words) for _ in range(runs)),
+            }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the NumPy inference backend")
+    parser.add_argument("--lang", default="cs")
+    parser.add_argument("--model-path", default=None, help="Checkpoint, defaults to the pretrained model of --lang")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(__file__), "data", "cs", "test.tsv"))
+    parser.add_argument("--latency-words", type=int, default=200, help="Words segmented one at a time")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None, help="torch threads, defaults to torch's choice")
+    parser.add_argument("--save-dir", default=None, help="Keep the exported .npz in this directory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        report = benchmark(args.lang, args.data, args.save_dir or temporary_dir, model_path=args.model_path,
+                           latency_words=args.latency_words, runs=args.runs, threads=args.threads)
+    print(json.dumps(report, indent=2))
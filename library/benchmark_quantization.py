@@ -0,0 +1,98 @@
+"""
+Benchmark dynamic int8 quantization against the fp32 model.
+
+Loads the same checkpoint with and without `quantize="int8"`, then reports:
+- the best-of-N predict time over the test words, and the speed-up;
+- the serialized model size;
+- the change in word accuracy and boundary F1 from `eval_model`.
+
+Usage (from the repository root):
+    python library/benchmark_quantization.py --lang cs --data library/data/cs/test.tsv
+    python library/benchmark_quantization.py --lang cs --model-path my_model.pt --save-dir quantized/
+Without --model-path the pretrained model of --lang is used, see `PRETRAINED_MODELS` in `morpheme_segmenter`.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+from typing import Tuple
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library.testmorphseg.interface.morpheme_segmenter import MorphemeSegmenter
+
+
+def _model_size(segmenter: MorphemeSegmenter) -> int:
+    buffer = io.BytesIO()
+    torch.save(segmenter.sequence_labeller.model.model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def _predict_seconds(segmenter: MorphemeSegmenter, sources, runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        segmenter.sequence_labeller.predict(sources=sources)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(lang: str, data: str, model_path=None, runs: int = 3,
+              threads=None) -> Tuple[dict, MorphemeSegmenter]:
+    if threads is not None:
+        torch.set_num_threads(threads)
+
+    results = {}
+    segmenters = {}
+    for mode in ("fp32", "int8"):
+        # eval_model and model loading print a lot, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            segmenter = MorphemeSegmenter(lang, model_path=model_path, quantize=None if mode == "fp32" else mode)
+            segmenter.device = torch.device("cpu")
+            segmenter.sequence_labeller.settings.device = segmenter.device
+            metrics = segmenter.eval_model(data)
+            sources = segmenter._load_data(data).sources
+        segmenters[mode] = segmenter
+        results[mode] = {
+            'predict_seconds': _predict_seconds(segmenter, sources, runs),
+            'model_bytes': _model_size(segmenter),
+            'word_accuracy': metrics['word_accuracy'],
+            'f1': metrics['f1'],
+        }
+
+    fp32, int8 = results["fp32"], results["int8"]
+    return {
+        'lang': lang,
+        'data': os.path.abspath(data),
+        'num_words': len(sources),
+        'threads': torch.get_num_threads(),
+        'fp32': fp32,
+        'int8': int8,
+        'speedup': fp32['predict_seconds'] / int8['predict_seconds'],
+        'size_ratio': int8['model_bytes'] / fp32['model_bytes'],
+        'word_accuracy_delta': int8['word_accuracy'] - fp32['word_accuracy'],
+        'f1_delta': int8['f1'] - fp32['f1'],
+    }, segmenters["int8"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark int8 dynamic quantization")
+    parser.add_argument("--lang", default="cs")
+    parser.add_argument("--model-path", default=None, help="Checkpoint, defaults to the pretrained model of --lang")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(__file__), "data", "cs", "test.tsv"))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None, help="torch threads, defaults to torch's choice")
+    parser.add_argument("--save-dir", default=None, help="Also save the quantized model to this directory")
+    args = parser.parse_args()
+
+    report, quantized = benchmark(args.lang, args.data, model_path=args.model_path, runs=args.runs,
+                                  threads=args.threads)
+    if args.save_dir is not None:
+        report['saved_to'] = quantized.save(args.save_dir, name=f"{args.lang}_int8")
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,89 @@
+"""
+Import time budget for the testmorphseg package.
+
+Each import is timed in fresh interpreters, and the median of several runs is compared against a budget. The script
+also checks that the import does not load heavy optional dependencies. Neither `import testmorphseg` nor importing
+the inference entry points (MorphemeSegmenter, SegmenterPool and segment_corpus) may load torch, which is only
+imported once a checkpoint or TorchScript model is loaded, so NumPy models run without it. Exits with status 1 when
+a budget is exceeded or a forbidden module is loaded.
+
+Usage (from the repository root):
+    python library/check_import_time.py
+    python library/check_import_time.py --runs 9 --package-budget-ms 30 --segmenter-budget-ms 100
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["spacy", "pandas", "editdistance", "rich", "tqdm"]
+# Imports of the inference entry points, each timed against --segmenter-budget-ms
+ENTRY_POINTS = {
+    "MorphemeSegmenter": "from {package} import MorphemeSegmenter",
+    "SegmenterPool": "from {package} import SegmenterPool",
+    "segment_corpus": "from {package}.interface.corpus import segment_corpus",
+}
+
+TIMER = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(m for m in {modules!r} if m in sys.modules)}}))
+"""
+
+
+def time_import(statement: str, modules: list, runs: int) -> dict:
+    samples = []
+    loaded = set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", TIMER.format(statement=statement, modules=modules)],
+            cwd=REPO_ROOT, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        samples.append(result["seconds"])
+        loaded.update(result["modules"])
+    return {'median_ms': 1000 * statistics.median(samples), 'loaded': sorted(loaded)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check the import time budget of testmorphseg")
+    parser.add_argument("--package", default="library.testmorphseg", help="Import path of the package")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--package-budget-ms", type=float, default=50.0)
+    parser.add_argument("--segmenter-budget-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    package = time_import(f"import {args.package}", ["torch"] + HEAVY_MODULES, args.runs)
+    entry_points = {
+        name: time_import(statement.format(package=args.package), ["torch"] + HEAVY_MODULES, args.runs)
+        for name, statement in ENTRY_POINTS.items()
+    }
+
+    failures = []
+    if package['median_ms'] > args.package_budget_ms:
+        failures.append(f"import {args.package} took {package['median_ms']:.1f} ms, budget {args.package_budget_ms} ms")
+    if package['loaded']:
+        failures.append(f"import {args.package} loaded {', '.join(package['loaded'])}")
+    for name, entry_point in entry_points.items():
+        if entry_point['median_ms'] > args.segmenter_budget_ms:
+            failures.append(
+                f"{name} import took {entry_point['median_ms']:.1f} ms, budget {args.segmenter_budget_ms} ms"
+            )
+        if entry_point['loaded']:
+            failures.append(f"{name} import loaded {', '.join(entry_point['loaded'])}")
+
+    print(json.dumps({
+        'package_ms': round(package['median_ms'], 1),
+        **{f"{name}_ms": round(entry_point['median_ms'], 1) for name, entry_point in entry_points.items()},
+        'failures': failures,
+    }, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,26 @@
 #import spacy_pipeline
-from library.testmorphseg.interface.morpheme_segmenter import MorphemeSegmenter
-from library.testmorphseg.interface.spacy_component import load_spacy_integration
+import importlib
+
+# Public names and the modules defining them. They are imported on first access, so `import testmorphseg` stays
+# cheap and torch or spaCy are only loaded when they are actually used
+_LAZY_ATTRIBUTES = {
+    "MorphemeSegmenter": "library.testmorphseg.interface.morpheme_segmenter",
+    "load_spacy_integration": "library.testmorphseg.interface.spacy_component",
+    "SegmenterPool": "library.testmorphseg.interface.replica_pool",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    # Cache on the package, later lookups don't go through __getattr__ again
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
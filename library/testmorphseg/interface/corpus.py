@@ -0,0 +1,131 @@
+import os
+import copy
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterable, Iterator, Optional, Tuple, Union
+from library.testmorphseg.interface.exported_labeller import ExportedSequenceLabeller, runs_on_torch
+from library.testmorphseg.interface.morpheme_segmenter import MorphemeSegmenter, WORD_PATTERN
+
+# Bytes of input per work item. Blocks end at a line break, so no word is split between two workers. Lines
+# longer than a block are split at whitespace instead
+DEFAULT_BLOCK_SIZE = 1 << 20
+# ASCII whitespace bytes, which never occur inside a multi-byte UTF-8 character
+WHITESPACE_BYTES = b" \t\n\r\f\v"
+# Work items queued per worker, enough to keep every worker busy while the output is written in order
+BLOCKS_IN_FLIGHT_PER_WORKER = 2
+
+# Segmenter of the current worker process, created once by _init_worker
+_worker_segmenter = None
+
+
+def _init_worker(lang, sequence_labeller, cache_size, persistent_cache, num_threads):
+    global _worker_segmenter
+    # NumPy models already run on the CPU, and workers running them never import torch
+    if runs_on_torch(sequence_labeller):
+        import torch
+
+        # Each worker gets its share of the cores, torch's own thread pool would otherwise oversubscribe them
+        torch.set_num_threads(num_threads)
+        device = torch.device("cpu")
+        if isinstance(sequence_labeller, ExportedSequenceLabeller):
+            sequence_labeller.to(device)
+        else:
+            sequence_labeller.settings.device = device
+            sequence_labeller.model.model.to(device)
+    _worker_segmenter = MorphemeSegmenter.from_sequence_labeller(
+        lang, sequence_labeller, cache_size=cache_size, persistent_cache=persistent_cache
+    )
+
+
+def _segment_block(block: bytes, delimiter: str) -> Tuple[bytes, int]:
+    # Blocks travel as raw UTF-8 bytes both ways, which pickle as one flat buffer instead of many small objects.
+    # Invalid bytes become U+FFFD, so one bad byte doesn't fail the whole corpus
+    text = block.decode("utf-8", errors="replace")
+    segmented = _worker_segmenter.segment(text, output_string=True, delimiter=delimiter)
+    num_words = sum(1 for _ in WORD_PATTERN.finditer(text))
+    return segmented.encode("utf-8"), num_words
+
+
+def _split_point(block: bytes) -> int:
+    # After the last whitespace, or failing that before the last (possibly incomplete) UTF-8 character
+    cut = max(block.rfind(byte) for byte in WHITESPACE_BYTES) + 1
+    if cut > 0:
+        return cut
+    cut = len(block) - 1
+    while cut > 0 and block[cut] & 0xC0 == 0x80:
+        cut -= 1
+    return cut or len(block)
+
+
+def iter_blocks(paths: Iterable[Union[str, os.PathLike]], block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Read files as blocks of about `block_size` bytes, each ending at a line break or at the end of a file.
+    A line still going on `block_size` bytes past the end of the block is split at whitespace, so blocks stay
+    below a few times `block_size`.
+    """
+    for path in paths:
+        with open(path, "rb") as corpus_file:
+            rest = b""
+            while True:
+                block = rest + corpus_file.read(block_size)
+                rest = b""
+                if not block:
+                    break
+                # Complete the current line, so the block never ends inside a word or a multi-byte character
+                if not block.endswith(b"\n"):
+                    line = corpus_file.readline(block_size)
+                    block += line
+                    if len(line) == block_size and not line.endswith(b"\n"):
+                        cut = _split_point(block)
+                        block, rest = block[:cut], block[cut:]
+                yield block
+
+
+def segment_corpus(segmenter: MorphemeSegmenter, paths: Iterable[Union[str, os.PathLike]],
+                   output: Union[str, os.PathLike, BinaryIO], workers: Optional[int] = None, delimiter: str = " @@",
+                   block_size: int = DEFAULT_BLOCK_SIZE) -> dict:
+    """
+    Segment the files in `paths` with a pool of `workers` processes and write the segmented text, in input order,
+    to `output` (a file path or a binary file object). See MorphemeSegmenter.segment_corpus.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Only the model is sent to the workers, a stage timer may reference objects that can't be pickled
+    sequence_labeller = copy.copy(segmenter.sequence_labeller)
+    sequence_labeller.stage_timer = None
+    cache_size = segmenter.cache.capacity if segmenter.cache is not None else 0
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    start = time.perf_counter()
+    stats = {'blocks': 0, 'bytes': 0, 'words': 0}
+    sink = open(output, "wb") if isinstance(output, (str, os.PathLike)) else output
+    try:
+        # Workers are spawned rather than forked: forking after torch created its thread pool can deadlock
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+            initargs=(segmenter.lang, sequence_labeller, cache_size, segmenter.persistent_cache_path, num_threads)
+        ) as pool:
+            pending = deque()
+            for block in iter_blocks(paths, block_size):
+                stats['bytes'] += len(block)
+                pending.append(pool.submit(_segment_block, block, delimiter))
+                # Bound the work in flight, so memory doesn't grow with the size of the corpus
+                if len(pending) >= workers * BLOCKS_IN_FLIGHT_PER_WORKER:
+                    _write_result(pending.popleft(), sink, stats)
+            while pending:
+                _write_result(pending.popleft(), sink, stats)
+    finally:
+        if sink is not output:
+            sink.close()
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['words_per_second'] = stats['words'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    return stats
+
+
+def _write_result(future, sink: BinaryIO, stats: dict) -> None:
+    segmented, num_words = future.result()
+    sink.write(segmented)
+    stats['blocks'] += 1
+    stats['words'] += num_words
@@ -0,0 +1,67 @@
+import zipfile
+
+from typing import Dict, List, Optional
+from library.testmorphseg.utils.prediction import StageTimerMixin
+
+# Name of the JSON file stored next to the compiled graph in a TorchScript artifact
+METADATA_FILE = "metadata.json"
+# Entry of a NumPy (.npz) artifact holding the vocabularies and settings as a JSON string
+METADATA_KEY = "metadata"
+
+
+def is_torchscript_artifact(path) -> bool:
+    """TorchScript archives hold compiled code, checkpoints written by `torch.save` only hold pickled data"""
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any(name.endswith("/constants.pkl") for name in archive.namelist())
+
+
+def is_numpy_artifact(path) -> bool:
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return METADATA_KEY + ".npy" in archive.namelist()
+
+
+def runs_on_torch(sequence_labeller) -> bool:
+    """Checkpoints and TorchScript models run on torch, NumPy models don't need it"""
+    return not isinstance(sequence_labeller, ExportedSequenceLabeller) or sequence_labeller.format != "numpy"
+
+
+def export_metadata(model) -> dict:
+    """Vocabularies and settings of a `training.trainer.TrainedModel` that every exported artifact stores as JSON"""
+    # Only exporting needs the training code, loading an artifact doesn't
+    from library.testmorphseg.training.trainer import model_fingerprint
+
+    return {
+        "source_alphabet": model.source_vocabulary.alphabet,
+        "unk_idx": model.source_vocabulary.unk_idx,
+        "target_alphabet": model.target_vocabulary.alphabet,
+        "pad_token": model.target_vocabulary.PAD_TOKEN,
+        "tau": model.settings.tau,
+        "loss": model.settings.loss,
+        # Same predictions as the source checkpoint, so both can share persistent cache entries
+        "fingerprint": model_fingerprint(model),
+    }
+
+
+class ExportedSequenceLabeller(StageTimerMixin):
+    """
+    Base of the labellers running artifacts written by `MorphemeSegmenter.export`. Artifacts carry the vocabularies
+    and settings from `export_metadata`, so running them needs neither the training code nor pickled Settings.
+    """
+    # Name of the export format and file suffix of its artifacts
+    format: str = ""
+    suffix: str = ""
+
+    def __init__(self, metadata: dict) -> None:
+        self.metadata = metadata
+        self.tau: int = metadata["tau"]
+        self.loss: str = metadata["loss"]
+        self.fingerprint: str = metadata["fingerprint"]
+        self.quantization: Optional[str] = metadata.get("quantization")
+        self.source_index: Dict[str, int] = {symbol: idx for idx, symbol in enumerate(metadata["source_alphabet"])}
+        self.unk_idx: int = metadata["unk_idx"]
+        self.target_alphabet: List[str] = metadata["target_alphabet"]
+        self.pad_token: str = metadata["pad_token"]
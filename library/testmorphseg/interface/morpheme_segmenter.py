@@ -1,22 +1,105 @@
-import torch
 import re
-from library.testmorphseg.training.sequence_labeller import SequenceLabeller
-from library.testmorphseg.training.oracle import sent2rules, rules2sent
-from library.testmorphseg.utils.settings import Settings
-from library.testmorphseg.training.dataset import RawDataset
+import codecs
+from library.testmorphseg.utils.actions import rules2sent
+from library.testmorphseg.utils.cache import LRUCache
+from library.testmorphseg.utils.persistent_cache import PersistentActionCache
+from library.testmorphseg.interface.exported_labeller import ExportedSequenceLabeller
+from library.testmorphseg.interface.exported_labeller import is_numpy_artifact, is_torchscript_artifact
+from typing import Dict, Iterator, List, Optional, Tuple
 import os
-import pandas as pd
 from importlib import resources
 
+# Words are maximal runs of ASCII letters, apostrophes and hyphens
+WORD_PATTERN = re.compile(r"[a-zA-Z'-]+")
+# Characters read from a file object at a time by segment_stream
+STREAM_READ_SIZE = 64 * 1024
+# Artifact formats of `MorphemeSegmenter.export`. Exported models carry their own vocabularies and decoder, so
+# running them doesn't need the training code, which is only imported to load, train, quantize, save or export
+# checkpoints. NumPy artifacts don't need torch either
+EXPORT_FORMATS = ("torchscript", "numpy")
+# Checkpoint shipped in models/pretrained_models for each language with a pretrained model
+PRETRAINED_MODELS = {"cs": "ces.pt"}
+
+
+def _iter_text(source) -> Iterator[str]:
+    # Text pieces of a string, a text or binary file object, or an iterable of strings
+    if isinstance(source, str):
+        for start in range(0, len(source), STREAM_READ_SIZE):
+            yield source[start:start + STREAM_READ_SIZE]
+    elif hasattr(source, "read"):
+        decoder = None
+        while True:
+            piece = source.read(STREAM_READ_SIZE)
+            if not piece:
+                break
+            if isinstance(piece, bytes):
+                decoder = decoder or codecs.getincrementaldecoder("utf-8")()
+                piece = decoder.decode(piece)
+            yield piece
+        if decoder is not None:
+            yield decoder.decode(b"", final=True)
+    else:
+        for piece in source:
+            if type(piece) is not str:
+                raise ValueError("Input stream must yield strings.")
+            yield piece
+
+
+def _take_chunk(buffer: str, start: int, chunk_words: int, max_buffer_chars: int,
+                final: bool) -> Tuple[Optional[str], int]:
+    """
+    Take the next chunk of at most `chunk_words` complete words from `buffer`, starting at offset `start`.
+    Returns the chunk and the offset of the rest of the buffer, or (None, start) when more input is needed.
+    A word touching the end of the buffer may continue in the next piece, so it is only taken when `final`.
+    """
+    if final:
+        matches = list(zip(range(chunk_words), WORD_PATTERN.finditer(buffer, start)))
+        cut = matches[-1][1].end() if len(matches) == chunk_words else len(buffer)
+        return buffer[start:cut], cut
+
+    complete = []
+    for match in WORD_PATTERN.finditer(buffer, start):
+        if match.end() == len(buffer) or len(complete) == chunk_words:
+            break
+        complete.append(match)
+    if len(complete) == chunk_words:
+        cut = complete[-1].end()
+    elif len(buffer) - start > max_buffer_chars:
+        # Not enough words yet, but don't let text without many words pile up: keep only a trailing partial word,
+        # unless that word alone is longer than the limit
+        trailing = WORD_PATTERN.search(buffer, complete[-1].end() if complete else start)
+        cut = trailing.start() if trailing is not None and trailing.end() == len(buffer) else len(buffer)
+        cut = cut if cut > start else len(buffer)
+    else:
+        return None, start
+    return buffer[start:cut], cut
+
+
 class MorphemeSegmenter:
-    def __init__(self, lang, model_path=None, train_from_scratch=False):
+    def __init__(self, lang, model_path=None, train_from_scratch=False, cache_size=0, persistent_cache=None,
+                 quantize=None):
         self.lang = lang
         self.train_from_scratch = train_from_scratch
         if type(lang) is not str:
             raise ValueError("Language must be a string.")
         if type(train_from_scratch) is not bool:
             raise ValueError("train_from_scratch must be a boolean.")
-        pretrained_model_langs = ["en", "cs"]
+        if type(cache_size) is not int or cache_size < 0:
+            raise ValueError("cache_size must be a non-negative integer.")
+        # Optional LRU cache of word -> predicted actions, shared by all calls on this segmenter
+        self.cache: Optional[LRUCache] = LRUCache(cache_size) if cache_size > 0 else None
+        # Optional path of an SQLite file of word -> predicted actions, shared across processes and runs
+        if persistent_cache is not None and not isinstance(persistent_cache, (str, os.PathLike)):
+            raise ValueError("persistent_cache must be a file path.")
+        self.persistent_cache_path = persistent_cache
+        self.persistent_cache: Optional[PersistentActionCache] = None
+        # Optional dynamic quantization of the LSTM and Linear layers at load time, CPU only
+        if quantize is not None:
+            from library.testmorphseg.training.trainer import QUANTIZATION_DTYPES
+            if quantize not in QUANTIZATION_DTYPES:
+                raise ValueError(f"quantize must be None or one of {list(QUANTIZATION_DTYPES)}.")
+        self.quantize = quantize
+        pretrained_model_langs = list(PRETRAINED_MODELS)
         if lang not in pretrained_model_langs and train_from_scratch is False:
             print(f"'{lang}' does not have a pretrained model. You must train from scratch using the train method.")
             self.train_from_scratch = True
@@ -27,50 +110,276 @@ class MorphemeSegmenter:
         if self.train_from_scratch is True:
             self.sequence_labeller = None
             return
-        if torch.cuda.is_available():
-            self.device = torch.device('cuda')
-        elif torch.backends.mps.is_available():
-            self.device = torch.device('mps')
-        else:
-            self.device = torch.device('cpu')
+        if model_path is not None and is_torchscript_artifact(model_path):
+            from library.testmorphseg.interface.scripted_labeller import ScriptedSequenceLabeller
+            self._load_exported(ScriptedSequenceLabeller.load(model_path, 'cpu'))
+            return
+        if model_path is not None and is_numpy_artifact(model_path):
+            from library.testmorphseg.interface.numpy_labeller import NumpySequenceLabeller
+            self._load_exported(NumpySequenceLabeller.load(model_path))
+            return
+        import torch
+        from library.testmorphseg.training.sequence_labeller import SequenceLabeller
+        from library.testmorphseg.training.trainer import quantize_model
+
+        # Checkpoints are loaded on the CPU, the device is only picked once it is known whether the model is
+        # quantized. Quantized weights can't be mapped to other devices
         if model_path is not None:
-            self.sequence_labeller = SequenceLabeller.load(model_path, self.device)
+            self.sequence_labeller = SequenceLabeller.load(model_path, torch.device('cpu'))
         if model_path is None:
-            with resources.path("testmorphseg.non_spacy.pretrained_models", f"{lang}.pt") as model_path:#path relative to package
-                self.sequence_labeller = SequenceLabeller.load(model_path, self.device)
+            with resources.path("library.testmorphseg.models.pretrained_models", PRETRAINED_MODELS[lang]) as model_path:
+                self.sequence_labeller = SequenceLabeller.load(model_path, torch.device('cpu'))
+        # A checkpoint saved after quantization is already quantized, see `save`
+        if getattr(self.sequence_labeller.model.model, "quantization", None) is not None:
+            self.quantize = self.sequence_labeller.model.model.quantization
+        elif quantize is not None:
+            self.sequence_labeller.model = quantize_model(self.sequence_labeller.model, quantize)
+        self.device = self._pick_device(quantized=self.quantize is not None)
         self.sequence_labeller.settings.device = self.device
         self.sequence_labeller.model.model.to(self.device)
         self.sequence_labeller.model.model.device = self.device
         self.settings = self.sequence_labeller.settings
+        self._open_persistent_cache()
+
+    @staticmethod
+    def _pick_device(quantized: bool):
+        import torch
+
+        # Quantized kernels only run on the CPU
+        if quantized:
+            return torch.device('cpu')
+        elif torch.cuda.is_available():
+            return torch.device('cuda')
+        elif torch.backends.mps.is_available():
+            return torch.device('mps')
+        return torch.device('cpu')
+
+    def _load_exported(self, sequence_labeller):
+        # Artifact written by `export`, it carries its own vocabularies and decoder
+        if self.quantize is not None:
+            raise ValueError("quantize can't be applied to an exported model.")
+        self.sequence_labeller = sequence_labeller
+        self.quantize = sequence_labeller.quantization
+        self.device = sequence_labeller.device
+        if sequence_labeller.format == "torchscript":
+            self.device = self._pick_device(quantized=self.quantize is not None)
+            self.sequence_labeller.to(self.device)
+        self.settings = None
+        self._open_persistent_cache()
+
+    @classmethod
+    def from_sequence_labeller(cls, lang, sequence_labeller, cache_size=0, persistent_cache=None):
+        """Wrap an already loaded SequenceLabeller, without reading a checkpoint"""
+        segmenter = cls.__new__(cls)
+        segmenter.lang = lang
+        segmenter.train_from_scratch = False
+        if isinstance(sequence_labeller, ExportedSequenceLabeller):
+            segmenter.quantize = sequence_labeller.quantization
+            segmenter.device = sequence_labeller.device
+            segmenter.settings = None
+        else:
+            segmenter.quantize = getattr(sequence_labeller.model.model, "quantization", None)
+            segmenter.device = sequence_labeller.settings.device
+            segmenter.settings = sequence_labeller.settings
+        segmenter.cache = LRUCache(cache_size) if cache_size > 0 else None
+        segmenter.persistent_cache_path = persistent_cache
+        segmenter.persistent_cache = None
+        segmenter.sequence_labeller = sequence_labeller
+        segmenter._open_persistent_cache()
+        return segmenter
 
     def segment(self, text, output_string=False, delimiter=" @@"):
-        if self.sequence_labeller is None:
-            raise RuntimeError("Model not trained. Please train the model before segmentation.")
+        self._check_segment_args(output_string, delimiter)
         if type(text) is not str:
             raise ValueError("Input sequence must be a string.")
+        if text == "":
+            return []
+
+        # Extract all words
+        words = [word.lower() for word in WORD_PATTERN.findall(text)]
+        segmentations = self._segment_words(list(dict.fromkeys(words)), delimiter)
+        return self._format_output(text, [segmentations[word] for word in words], output_string, delimiter)
+
+    def segment_batch(self, texts, output_string=False, delimiter=" @@"):
+        """
+        Segment many texts at once, returning one result per text in the same format as `segment`.
+        The words of all texts are pooled, so the model runs full batches over each distinct word once.
+        """
+        self._check_segment_args(output_string, delimiter)
+        if not isinstance(texts, (list, tuple)) or any(type(text) is not str for text in texts):
+            raise ValueError("Input texts must be a list of strings.")
+
+        words_per_text = [[word.lower() for word in WORD_PATTERN.findall(text)] for text in texts]
+        unique_words = list(dict.fromkeys(word for words in words_per_text for word in words))
+        segmentations = self._segment_words(unique_words, delimiter)
+        return [
+            self._format_output(text, [segmentations[word] for word in words], output_string, delimiter)
+            if text != "" else []
+            for text, words in zip(texts, words_per_text)
+        ]
+
+    def segment_stream(self, source, output_string=False, delimiter=" @@", chunk_words=1024):
+        """
+        Lazily segment a large input and yield the output chunk by chunk. `source` is a string, a text or binary
+        (UTF-8) file object, or an iterable of strings. Text is tokenized and predicted in chunks of `chunk_words`
+        words, so memory stays bounded by the chunk size rather than by the size of the input.
+
+        With output_string=True each yielded item is the segmented text of one chunk, and joining them gives the
+        same result as `segment(text, output_string=True)`. Otherwise each item is the list of segmented words of
+        one chunk, and concatenating them gives the same result as `segment(text)`.
+        """
+        self._check_segment_args(output_string, delimiter)
+        if type(chunk_words) is not int or chunk_words < 1:
+            raise ValueError("chunk_words must be a positive integer.")
+        # Rough upper bound on buffered text, so inputs with few words are still emitted in pieces
+        max_buffer_chars = max(STREAM_READ_SIZE, 64 * chunk_words)
+
+        buffer = ""
+        start = 0
+        for piece in _iter_text(source):
+            # Taken chunks are only dropped from the buffer once per piece, not once per chunk
+            buffer = buffer[start:] + piece
+            start = 0
+            while True:
+                chunk, start = _take_chunk(buffer, start, chunk_words, max_buffer_chars, final=False)
+                if chunk is None:
+                    break
+                yield from self._segment_chunk(chunk, output_string, delimiter)
+        while start < len(buffer):
+            chunk, start = _take_chunk(buffer, start, chunk_words, max_buffer_chars, final=True)
+            yield from self._segment_chunk(chunk, output_string, delimiter)
+
+    def _segment_chunk(self, chunk: str, output_string: bool, delimiter: str):
+        words = [word.lower() for word in WORD_PATTERN.findall(chunk)]
+        if not words and not output_string:
+            return
+        segmentations = self._segment_words(list(dict.fromkeys(words)), delimiter)
+        yield self._format_output(chunk, [segmentations[word] for word in words], output_string, delimiter)
+
+    def segment_corpus(self, paths, output, workers=None, delimiter=" @@", block_size=None):
+        """
+        Segment large corpus files on `workers` processes and write the segmented text to `output`, a file path
+        or a binary file object, in the order of `paths`. Each worker loads the model once. Input and output travel
+        between processes as UTF-8 byte blocks. Returns throughput statistics.
+
+        Workers are started with the "spawn" method, so scripts calling this need an `if __name__ == "__main__":`
+        guard.
+        """
+        from library.testmorphseg.interface.corpus import DEFAULT_BLOCK_SIZE, segment_corpus
+
+        self._check_segment_args(False, delimiter)
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        if workers is not None and (type(workers) is not int or workers < 1):
+            raise ValueError("workers must be a positive integer.")
+        return segment_corpus(
+            self, paths, output, workers=workers, delimiter=delimiter, block_size=block_size or DEFAULT_BLOCK_SIZE
+        )
+
+    def _check_segment_args(self, output_string, delimiter):
+        if self.sequence_labeller is None:
+            raise RuntimeError("Model not trained. Please train the model before segmentation.")
         if type(output_string) is not bool:
             raise ValueError("output_string must be a boolean.")
         if type(delimiter) is not str:
             raise ValueError("Delimiter must be a string.")
-        if text == "":
-            return []
 
-        # Extract all words
-        words = re.findall(r"[a-zA-Z'-]+", text)
-        words = [list(word.lower()) for word in words]
-        # Process all words at once
-        predictions = self.sequence_labeller.predict(sources=words)
-        actions = [pred.prediction for pred in predictions]
-        predicted_segmentations = [rules2sent(source=words[i], actions=actions[i]).replace(" @@", delimiter) for i in range(len(words))]
+    def _segment_words(self, words: List[str], delimiter: str) -> Dict[str, str]:
+        # Predict and rebuild every distinct word only once
+        actions = self._predict_actions(words)
+        return {word: rules2sent(source=list(word), actions=list(actions[word])).replace(" @@", delimiter) for word in words}
+
+    def _format_output(self, text: str, predicted_segmentations: List[str], output_string: bool, delimiter: str):
         if output_string is True:
             # Create iterator for transformed words
             word_iter = iter(predicted_segmentations)
             # Replace each match with next transformed word
-            return re.sub(r"[a-zA-Z'-]+", lambda m: next(word_iter), text)
-        if output_string is False:
-            if delimiter == "":
-                return [[char for char in seg] for seg in predicted_segmentations]
-            return [word.split(delimiter) for word in predicted_segmentations]
+            return WORD_PATTERN.sub(lambda m: next(word_iter), text)
+        if delimiter == "":
+            return [[char for char in seg] for seg in predicted_segmentations]
+        return [word.split(delimiter) for word in predicted_segmentations]
+
+    def _predict_actions(self, words: List[str]) -> Dict[str, tuple]:
+        # Action sequence of each distinct lowercased word. Words are looked up in the memory cache, then in the
+        # persistent cache, and only words missing from both reach the model
+        actions = self.cache.get_many(words) if self.cache is not None else dict()
+        missing = [word for word in words if word not in actions]
+        if missing and self.persistent_cache is not None:
+            stored = self.persistent_cache.get_many(missing)
+            if self.cache is not None:
+                self.cache.put_many(stored)
+            actions.update(stored)
+            missing = [word for word in missing if word not in stored]
+        if missing:
+            predictions = self.sequence_labeller.predict(sources=[list(word) for word in missing])
+            predicted = {word: tuple(pred.prediction) for word, pred in zip(missing, predictions)}
+            if self.cache is not None:
+                self.cache.put_many(predicted)
+            if self.persistent_cache is not None:
+                self.persistent_cache.put_many(predicted)
+            actions.update(predicted)
+        return actions
+
+    def _open_persistent_cache(self):
+        # Keyed by the model fingerprint, so entries of other checkpoints in the same file are never used
+        if self.persistent_cache is not None:
+            self.persistent_cache.close()
+            self.persistent_cache = None
+        if self.persistent_cache_path is not None and self.sequence_labeller is not None:
+            if isinstance(self.sequence_labeller, ExportedSequenceLabeller):
+                fingerprint = self.sequence_labeller.fingerprint
+            else:
+                from library.testmorphseg.training.trainer import model_fingerprint
+                fingerprint = model_fingerprint(self.sequence_labeller.model)
+            self.persistent_cache = PersistentActionCache(self.persistent_cache_path, fingerprint)
+
+    def cache_stats(self) -> Optional[dict]:
+        if self.cache is None and self.persistent_cache is None:
+            return None
+        stats = self.cache.stats() if self.cache is not None else {}
+        if self.persistent_cache is not None:
+            stats['persistent'] = self.persistent_cache.stats()
+        return stats
+
+    def clear_cache(self) -> None:
+        if self.cache is not None:
+            self.cache.clear()
+
+    def save(self, save_dir, name=None):
+        """Save the current model, e.g. after quantization, as `<save_dir>/<name>.pt` and return the path"""
+        if self.sequence_labeller is None:
+            raise RuntimeError("Model not trained. Please train the model before saving.")
+        if isinstance(self.sequence_labeller, ExportedSequenceLabeller):
+            return self._save_exported(save_dir, name)
+        from library.testmorphseg.training.trainer import save_model
+        return save_model(self.sequence_labeller.model, name=name or self.lang, path=save_dir)
+
+    def export(self, save_dir, name=None, format="torchscript"):
+        """
+        Export the current model for inference only and return the path. `format="torchscript"` compiles the model
+        and its decoder into `<save_dir>/<name>.ts`. `format="numpy"` writes the weights to `<save_dir>/<name>.npz`
+        for the NumPy backend, which runs without torch. `MorphemeSegmenter(lang, model_path=...)` loads both
+        without the training code or pickled Settings.
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of {list(EXPORT_FORMATS)}.")
+        if self.sequence_labeller is None:
+            raise RuntimeError("Model not trained. Please train the model before exporting.")
+        if isinstance(self.sequence_labeller, ExportedSequenceLabeller):
+            if self.sequence_labeller.format == format:
+                return self._save_exported(save_dir, name)
+            raise ValueError(f"An exported model can't be converted, export the original checkpoint as {format}.")
+        if format == "torchscript":
+            from library.testmorphseg.interface.scripted_labeller import export_torchscript as export_function
+        else:
+            from library.testmorphseg.interface.numpy_labeller import export_numpy as export_function
+        return export_function(self.sequence_labeller.model, name=name or self.lang, path=save_dir)
+
+    def _save_exported(self, save_dir, name):
+        os.makedirs(save_dir, exist_ok=True)
+        path = os.path.join(save_dir, (name or self.lang) + self.sequence_labeller.suffix)
+        self.sequence_labeller.save(path)
+        return path
 
     def train(self, data_filepath: str, save_path: str, test_data_filepath=None, **kwargs):
         if self.train_from_scratch is True:
@@ -78,7 +387,12 @@ class MorphemeSegmenter:
         # if self.train_from_scratch is False:
         #     self._fine_tune(data_filepath, save_path, **kwargs)
 
-    def _load_data(self, data_filepath: str) -> RawDataset:
+    def _load_data(self, data_filepath: str):
+        # pandas and the training code are only needed for training and evaluation data, import them lazily
+        import pandas as pd
+        from library.testmorphseg.training.dataset import RawDataset
+        from library.testmorphseg.training.oracle import sent2rules
+
         if str(data_filepath).endswith('.csv'):
             df = pd.read_csv(data_filepath)
         elif str(data_filepath).endswith('.tsv'):
@@ -162,12 +476,18 @@ class MorphemeSegmenter:
         train_data = self._load_data(train_data_filepath)
         test_data = self._load_data(test_data_filepath) if test_data_filepath is not None else None
 
+        from library.testmorphseg.utils.settings import Settings
+        from library.testmorphseg.training.sequence_labeller import SequenceLabeller
+
         # Initialize settings
         settings = Settings(name=self.lang, save_path=save_path, **kwargs)
 
         # Create and train model
         self.sequence_labeller = SequenceLabeller(settings=settings)
         self.sequence_labeller.fit(train_data=train_data, development_data=test_data)
+        # Cached actions came from the previous model
+        self.clear_cache()
+        self._open_persistent_cache()
 
     def eval_model(self, test_data_filepath: str) -> dict:
         test_data = self._load_data(test_data_filepath)
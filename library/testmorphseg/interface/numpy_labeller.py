@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple
+from library.testmorphseg.utils.prediction import Prediction, labels_to_prediction
+from library.testmorphseg.utils.prediction import DEFAULT_MAX_BATCH_CHARS, make_length_batches
+from library.testmorphseg.interface.exported_labeller import METADATA_KEY, ExportedSequenceLabeller, export_metadata
+
+# Coefficients of the erf approximation 7.1.26 in Abramowitz and Stegun (absolute error below 1.5e-7)
+_ERF_P = 0.3275911
+_ERF_A = (0.254829592, -0.284496736, 1.421413741, -1.453152027, 1.061405429)
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    # tanh form doesn't overflow for large negative inputs
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+def _erf(x: np.ndarray) -> np.ndarray:
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + _ERF_P * x)
+    a1, a2, a3, a4, a5 = _ERF_A
+    polynomial = ((((a5 * t + a4) * t + a3) * t + a2) * t + a1) * t
+    return sign * (1.0 - polynomial * np.exp(-x * x))
+
+
+def _gelu(x: np.ndarray) -> np.ndarray:
+    # Exact (erf based) GELU like torch's default, not the tanh approximation
+    return 0.5 * x * (1.0 + _erf(x / np.sqrt(2.0)).astype(x.dtype))
+
+
+def _log_softmax(x: np.ndarray) -> np.ndarray:
+    shifted = x - x.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+
+def _lstm_direction(inputs: np.ndarray, mask: np.ndarray, weight_ih: np.ndarray, weight_hh: np.ndarray,
+                    bias: np.ndarray, h: np.ndarray, c: np.ndarray, reverse: bool) -> np.ndarray:
+    """
+    One direction of one LSTM layer over a padded batch. Like a packed sequence in torch, each element only runs
+    over its own timesteps (the backward direction starts at its last character) and padding outputs are zero.
+    """
+    batch, timesteps, _ = inputs.shape
+    hidden_size = weight_hh.shape[1]
+    # Input projections of all timesteps in one matmul, only the recurrent part runs step by step
+    projected = inputs @ weight_ih.T + bias
+    outputs = np.zeros((batch, timesteps, hidden_size), dtype=inputs.dtype)
+
+    for t in (range(timesteps - 1, -1, -1) if reverse else range(timesteps)):
+        gates = projected[:, t] + h @ weight_hh.T
+        # torch's gate order: input, forget, cell, output
+        i, f, g, o = np.split(gates, 4, axis=1)
+        c_t = _sigmoid(f) * c + _sigmoid(i) * np.tanh(g)
+        h_t = _sigmoid(o) * np.tanh(c_t)
+        active = mask[:, t, None]
+        c = np.where(active, c_t, c)
+        h = np.where(active, h_t, h)
+        outputs[:, t] = np.where(active, h_t, 0.0)
+
+    return outputs
+
+
+def argmax_decode(logits: np.ndarray, lengths: np.ndarray) -> List[List[int]]:
+    predictions = logits.argmax(axis=-1)
+    return [prediction[:length].tolist() for prediction, length in zip(predictions, lengths)]
+
+
+def viterbi_decode(logits: np.ndarray, lengths: np.ndarray, transition_scores: np.ndarray, prior: np.ndarray,
+                   final_transition_scores: np.ndarray) -> List[List[int]]:
+    """NumPy version of `training.inference.viterbi_decode`"""
+    batch, timesteps, num_tags = logits.shape
+    emission_scores = _log_softmax(logits)
+
+    alpha = prior[None, :] + emission_scores[:, 0]
+    alphas = [alpha]
+    back_pointers = []
+    for t in range(1, timesteps):
+        scores = alpha[:, None, :] + transition_scores[None, :, :]
+        back_pointers.append(scores.argmax(axis=2))
+        alpha = scores.max(axis=2) + emission_scores[:, t]
+        alphas.append(alpha)
+
+    predictions = []
+    for batch_idx, length in enumerate(lengths.tolist()):
+        if length == 0:
+            predictions.append([])
+            continue
+        tag = int((alphas[length - 1][batch_idx] + final_transition_scores).argmax())
+        path = [tag]
+        for t in range(length - 1, 0, -1):
+            tag = int(back_pointers[t - 1][batch_idx, tag])
+            path.append(tag)
+        predictions.append(path[::-1])
+
+    return predictions
+
+
+def ctc_crf_decode(logits: np.ndarray, lengths: np.ndarray, transition_scores: np.ndarray, prior: np.ndarray,
+                   final_transition_scores: np.ndarray) -> List[List[int]]:
+    """NumPy version of `training.inference.ctc_crf_decode` (label 0 is blank)"""
+    batch, timesteps, num_tags = logits.shape
+    emission_scores = _log_softmax(logits)
+    blank_scores_cum = emission_scores[:, :, 0].cumsum(axis=1)
+
+    alpha = np.empty((batch, 0, num_tags), dtype=logits.dtype)
+    back_pointers_time = []
+    back_pointers_label = []
+
+    for t in range(timesteps):
+        # Score of predicting only blanks before t, with t being the first non-blank prediction
+        blank_score = emission_scores[:, :t, 0].sum(axis=1, keepdims=True)
+        alpha_t = emission_scores[:, t] + prior[None, :] + blank_score
+        best_prev_label = np.full((batch, num_tags), -1, dtype=np.int64)
+        best_prev_timestep = np.full((batch, num_tags), -1, dtype=np.int64)
+
+        if t > 0:
+            # Score of the best previous non-blank timestep s and tag, with blanks at s+1, ..., t-1
+            blank_scores = blank_scores_cum[:, t - 1:t] - blank_scores_cum[:, :t]
+            scores = (
+                alpha[:, :, :, None] + blank_scores[:, :, None, None] +
+                emission_scores[:, t][:, None, None, :] + transition_scores[None, None, :, :]
+            )
+            s = scores.argmax(axis=1)
+            scores = scores.max(axis=1)
+            prev_label = scores.argmax(axis=1)
+            scores = scores.max(axis=1)
+            s = np.take_along_axis(s, prev_label[:, None, :], axis=1)[:, 0]
+
+            superior = scores > alpha_t
+            alpha_t = np.where(superior, scores, alpha_t)
+            best_prev_label = np.where(superior, prev_label, best_prev_label)
+            best_prev_timestep = np.where(superior, s, best_prev_timestep)
+
+        alpha = np.concatenate([alpha, alpha_t[:, None, :]], axis=1)
+        back_pointers_time.append(best_prev_timestep)
+        back_pointers_label.append(best_prev_label)
+
+    # Score of each tag at each timestep being the last non-blank prediction
+    blank_scores_final = blank_scores_cum[np.arange(batch), lengths - 1][:, None]
+    blank_scores = blank_scores_final - blank_scores_cum
+    blank_scores[np.arange(timesteps)[None, :] >= lengths[:, None]] = -np.inf
+    final_scores = alpha + final_transition_scores[None, None, :] + blank_scores[:, :, None]
+
+    best_end_timestep = final_scores.argmax(axis=1)
+    best_end_label = final_scores.max(axis=1).argmax(axis=1)
+    best_end_timestep = best_end_timestep[np.arange(batch), best_end_label]
+
+    predictions = []
+    for batch_idx, length in enumerate(lengths.tolist()):
+        path = [0] * length
+        timestep = int(best_end_timestep[batch_idx])
+        label = int(best_end_label[batch_idx])
+        while timestep != -1:
+            path[timestep] = label
+            timestep, label = (
+                int(back_pointers_time[timestep][batch_idx, label]),
+                int(back_pointers_label[timestep][batch_idx, label])
+            )
+        predictions.append(path)
+
+    return predictions
+
+
+class NumpySequenceLabeller(ExportedSequenceLabeller):
+    """
+    Runs a model exported with `export_numpy` using only NumPy. It does the same computation as `LSTMModel` and its
+    decoder in float32: embedding lookup, BiLSTM, `reduce_dim`, expansion layer, GELU, classifier, and argmax,
+    Viterbi or CTC-CRF decoding. Predictions match `SequenceLabeller.predict` up to float rounding.
+    """
+    format = "numpy"
+    suffix = ".npz"
+    # The backend never uses a GPU, this mirrors the `device` of the torch backends
+    device = "cpu"
+
+    def __init__(self, weights: Dict[str, np.ndarray], metadata: dict) -> None:
+        super(NumpySequenceLabeller, self).__init__(metadata)
+        self.weights = weights
+        self.num_layers: int = metadata["num_layers"]
+        self.hidden_size: int = metadata["hidden_size"]
+
+        # Both LSTM biases are always added together
+        self._lstm_biases = {
+            suffix: weights[f"encoder.lstm.bias_ih_{suffix}"] + weights[f"encoder.lstm.bias_hh_{suffix}"]
+            for suffix in self._lstm_suffixes()
+        }
+
+    @classmethod
+    def load(cls, path) -> NumpySequenceLabeller:
+        with np.load(path, allow_pickle=False) as archive:
+            weights = {name: archive[name] for name in archive.files if name != METADATA_KEY}
+            metadata = json.loads(str(archive[METADATA_KEY]))
+        return cls(weights, metadata)
+
+    def save(self, path) -> None:
+        with open(path, "wb") as artifact:
+            np.savez(artifact, **self.weights, **{METADATA_KEY: np.array(json.dumps(self.metadata))})
+
+    def to(self, device) -> NumpySequenceLabeller:
+        if str(device) != "cpu":
+            raise ValueError("The NumPy backend only runs on the CPU.")
+        return self
+
+    def _lstm_suffixes(self) -> List[str]:
+        return [f"l{layer}{direction}" for layer in range(self.num_layers) for direction in ("", "_reverse")]
+
+    def logits(self, inputs: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """Classifier scores of shape [batch, tau * timesteps, labels] for padded character indices"""
+        weights = self.weights
+        batch, timesteps = inputs.shape
+        encoded = weights["embedding.weight"][inputs]
+        mask = np.arange(timesteps)[None, :] < np.maximum(lengths, 1)[:, None]
+
+        # Initial states are trained parameters of shape [2 * layers, 1, hidden], shared by all batch elements
+        h_0 = weights["encoder.h_0"]
+        c_0 = weights["encoder.c_0"]
+        for layer in range(self.num_layers):
+            directions = []
+            for direction, suffix in enumerate(("", "_reverse")):
+                state = 2 * layer + direction
+                name = f"l{layer}{suffix}"
+                directions.append(_lstm_direction(
+                    encoded, mask, weights[f"encoder.lstm.weight_ih_{name}"], weights[f"encoder.lstm.weight_hh_{name}"],
+                    self._lstm_biases[name], np.repeat(h_0[state], batch, axis=0),
+                    np.repeat(c_0[state], batch, axis=0), reverse=direction == 1
+                ))
+            encoded = np.concatenate(directions, axis=-1)
+
+        # Frozen models have reduce_dim fused into the expansion layer
+        if "encoder.reduce_dim.weight" in weights:
+            encoded = encoded @ weights["encoder.reduce_dim.weight"].T + weights["encoder.reduce_dim.bias"]
+        if self.tau > 1:
+            encoded = (
+                encoded @ weights["expansion_layer.expansion_layer.1.weight"].T +
+                weights["expansion_layer.expansion_layer.1.bias"]
+            )
+            encoded = encoded.reshape(batch, self.tau * timesteps, self.hidden_size)
+
+        return _gelu(encoded) @ weights["classifier.1.weight"].T + weights["classifier.1.bias"]
+
+    def _decode(self, logits: np.ndarray, lengths: np.ndarray) -> List[List[int]]:
+        lengths = self.tau * lengths
+        if self.loss in ("cross-entropy", "ctc"):
+            return argmax_decode(logits, lengths)
+        crf_scores = (
+            self.weights["crf.transition_scores"], self.weights["crf.prior"],
+            self.weights["crf.final_transition_scores"]
+        )
+        if self.loss == "crf":
+            return viterbi_decode(logits, lengths, *crf_scores)
+        return ctc_crf_decode(logits, lengths, *crf_scores)
+
+    def _collate(self, sources: List[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        lengths = np.array([len(source) for source in sources], dtype=np.int64)
+        inputs = np.zeros((len(sources), max(1, lengths.max(initial=0))), dtype=np.int64)
+        for row, source in enumerate(sources):
+            inputs[row, :len(source)] = [self.source_index.get(symbol, self.unk_idx) for symbol in source]
+        return inputs, lengths
+
+    def predict(self, sources: List[List[str]], features: Optional[List[List[str]]] = None,
+                max_batch_chars: int = DEFAULT_MAX_BATCH_CHARS) -> List[Prediction]:
+        if features is not None:
+            raise ValueError("NumPy models don't use features.")
+
+        predictions: List[Optional[Prediction]] = [None] * len(sources)
+        for indices in make_length_batches([len(source) for source in sources], max_batch_chars):
+            start = time.perf_counter()
+            batch_sources = [sources[idx] for idx in indices]
+            inputs, lengths = self._collate(batch_sources)
+            self._record_stage("collate", start)
+
+            start = time.perf_counter()
+            logits = self.logits(inputs, lengths)
+            self._record_stage("forward", start)
+
+            start = time.perf_counter()
+            for idx, source, labels in zip(indices, batch_sources, self._decode(logits, lengths)):
+                predictions[idx] = labels_to_prediction(source, labels, self.target_alphabet, self.pad_token, self.tau)
+            self._record_stage("decode", start)
+
+        return predictions
+
+
+def export_numpy(model, name: str, path: str) -> str:
+    """
+    Save the weights of a `training.trainer.TrainedModel` as float32 arrays, with the vocabularies and settings as
+    JSON, in `<path>/<name>.npz` for `NumpySequenceLabeller`. CRF scores are stored normalized.
+    """
+    if getattr(model.model, "quantization", None) is not None:
+        raise ValueError("Quantized models can't be exported to NumPy, export the float model instead.")
+    if model.model.use_features:
+        raise ValueError("Models with feature encoders can't be exported.")
+
+    weights = {
+        name: value.detach().cpu().float().numpy()
+        for name, value in model.model.state_dict().items() if not name.startswith("crf.")
+    }
+    if model.model.use_crf:
+        weights["crf.transition_scores"] = model.model.crf.transition_scores.T.detach().cpu().float().numpy()
+        weights["crf.prior"] = model.model.crf.prior.detach().cpu().float().numpy()
+        weights["crf.final_transition_scores"] = model.model.crf.final_transition_scores.detach().cpu().float().numpy()
+    metadata = dict(export_metadata(model), num_layers=model.model.num_layers, hidden_size=model.model.hidden_size)
+
+    os.makedirs(path, exist_ok=True)
+    export_path = os.path.join(path, name + NumpySequenceLabeller.suffix)
+    NumpySequenceLabeller(weights, metadata).save(export_path)
+    return export_path
@@ -0,0 +1,67 @@
+import os
+import threading
+from typing import Optional
+from library.testmorphseg.interface.morpheme_segmenter import MorphemeSegmenter
+from library.testmorphseg.interface.exported_labeller import ExportedSequenceLabeller, runs_on_torch
+
+
+class SegmenterPool:
+    """
+    Segmentation from many threads with a bounded number of forward passes running at once.
+
+    Concurrent calls on one MorphemeSegmenter are safe, but each runs its forward pass on the caller's thread, so
+    many caller threads run as many forward passes at once and, together with torch's intra-op threads,
+    oversubscribe the cores. Any number of caller threads can call a SegmenterPool's `segment` and `segment_batch`
+    concurrently, but at most `replicas` of the calls run at any time, the others block until one finishes. All
+    calls share the segmenter's model, which is prepared for inference once, so the pool costs no extra memory.
+
+    torch's intra-op thread count is a process-wide setting. For models running on torch the pool sets it to
+    `threads_per_replica`, which also applies to torch models used outside the pool. NumPy models don't need torch.
+
+        with SegmenterPool(MorphemeSegmenter("cs", cache_size=100_000), replicas=4) as pool:
+            results = thread_pool.map(pool.segment, texts)
+    """
+    def __init__(self, segmenter: MorphemeSegmenter, replicas: Optional[int] = None,
+                 threads_per_replica: int = 1) -> None:
+        if segmenter.sequence_labeller is None:
+            raise RuntimeError("Model not trained. Please train the model before segmentation.")
+        if type(threads_per_replica) is not int or threads_per_replica < 1:
+            raise ValueError("threads_per_replica must be a positive integer.")
+        if replicas is None:
+            replicas = max(1, (os.cpu_count() or 1) // threads_per_replica)
+        if type(replicas) is not int or replicas < 1:
+            raise ValueError("replicas must be a positive integer.")
+
+        self.replicas = replicas
+        self.threads_per_replica = threads_per_replica
+        self.segmenter = segmenter
+        self._slots = threading.BoundedSemaphore(replicas)
+        if runs_on_torch(segmenter.sequence_labeller):
+            import torch
+            torch.set_num_threads(threads_per_replica)
+        if not isinstance(segmenter.sequence_labeller, ExportedSequenceLabeller):
+            # Move the model to its device and into eval mode now, so concurrent calls find it ready and never
+            # modify it
+            segmenter.sequence_labeller._inference_model()
+
+    def _run(self, method: str, *args, **kwargs):
+        with self._slots:
+            return getattr(self.segmenter, method)(*args, **kwargs)
+
+    def segment(self, text, output_string=False, delimiter=" @@"):
+        """Thread safe MorphemeSegmenter.segment"""
+        return self._run("segment", text, output_string=output_string, delimiter=delimiter)
+
+    def segment_batch(self, texts, output_string=False, delimiter=" @@"):
+        """Thread safe MorphemeSegmenter.segment_batch"""
+        return self._run("segment_batch", texts, output_string=output_string, delimiter=delimiter)
+
+    def close(self) -> None:
+        # The pool holds no threads or copies of its own, this only keeps it usable as a context manager
+        pass
+
+    def __enter__(self) -> "SegmenterPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
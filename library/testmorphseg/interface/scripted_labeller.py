@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import io
+import os
+import copy
+import json
+import time
+import torch
+
+from typing import List, Optional
+from torch.nn.utils.rnn import pad_sequence
+from library.testmorphseg.utils.prediction import Prediction, labels_to_prediction
+from library.testmorphseg.utils.prediction import DEFAULT_MAX_BATCH_CHARS, make_length_batches
+from library.testmorphseg.interface.exported_labeller import METADATA_FILE, ExportedSequenceLabeller, export_metadata
+
+
+class ScriptedSequenceLabeller(ExportedSequenceLabeller):
+    """
+    Runs a model exported with `export_torchscript`. The artifact holds the compiled model and decoder, and the
+    vocabularies and settings needed for inference as JSON. `predict` returns the same predictions as
+    `SequenceLabeller.predict`.
+    """
+    format = "torchscript"
+    suffix = ".ts"
+
+    def __init__(self, graph: torch.jit.ScriptModule, metadata: dict, device) -> None:
+        super(ScriptedSequenceLabeller, self).__init__(metadata)
+        self.graph = graph
+        self.device = torch.device(device)
+
+    @classmethod
+    def load(cls, path, device) -> ScriptedSequenceLabeller:
+        extra_files = {METADATA_FILE: ""}
+        graph = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+        return cls(graph.eval(), json.loads(extra_files[METADATA_FILE]), device)
+
+    def save(self, path) -> None:
+        torch.jit.save(self.graph, path, _extra_files={METADATA_FILE: json.dumps(self.metadata)})
+
+    def to(self, device) -> ScriptedSequenceLabeller:
+        self.device = torch.device(device)
+        self.graph.to(self.device)
+        return self
+
+    def predict(self, sources: List[List[str]], features: Optional[List[List[str]]] = None,
+                max_batch_chars: int = DEFAULT_MAX_BATCH_CHARS) -> List[Prediction]:
+        if features is not None:
+            raise ValueError("TorchScript models don't use features.")
+
+        predictions: List[Optional[Prediction]] = [None] * len(sources)
+        for indices in make_length_batches([len(source) for source in sources], max_batch_chars):
+            start = time.perf_counter()
+            batch_sources = [sources[idx] for idx in indices]
+            inputs = pad_sequence(
+                [torch.tensor([self.source_index.get(symbol, self.unk_idx) for symbol in source], dtype=torch.long)
+                 for source in batch_sources],
+                batch_first=True, padding_value=0
+            )
+            lengths = torch.tensor([len(source) for source in batch_sources], dtype=torch.long)
+            self._record_stage("collate", start)
+
+            with torch.no_grad():
+                start = time.perf_counter()
+                # Batches come sorted by decreasing length, so the LSTM doesn't need to re-sort them
+                labels = self.graph(inputs, lengths, True).cpu().tolist()
+                self._record_stage("forward", start)
+
+            start = time.perf_counter()
+            for idx, source, source_labels in zip(indices, batch_sources, labels):
+                predictions[idx] = labels_to_prediction(
+                    source, source_labels, self.target_alphabet, self.pad_token, self.tau
+                )
+            self._record_stage("decode", start)
+
+        return predictions
+
+    def __getstate__(self) -> dict:
+        # Compiled graphs can't be pickled, send them as a serialized archive (e.g. to worker processes)
+        buffer = io.BytesIO()
+        torch.jit.save(self.graph, buffer)
+        state = dict(self.__dict__)
+        state["graph"] = buffer.getvalue()
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        state["graph"] = torch.jit.load(io.BytesIO(state["graph"]), map_location=state["device"]).eval()
+        self.__dict__.update(state)
+
+
+def export_torchscript(model, name: str, path: str) -> str:
+    """
+    Compile a `training.trainer.TrainedModel` and its decoder with TorchScript and save them, with the vocabularies
+    and settings as JSON, in `<path>/<name>.ts` for `ScriptedSequenceLabeller`.
+    """
+    # The model definitions are only needed to compile the graph, not to run it
+    from library.testmorphseg.models.scripted import InferenceGraph
+
+    graph = InferenceGraph(copy.deepcopy(model.model), loss=model.settings.loss).eval()
+    scripted = torch.jit.script(graph)
+    metadata = dict(export_metadata(model), quantization=getattr(model.model, "quantization", None))
+
+    os.makedirs(path, exist_ok=True)
+    export_path = os.path.join(path, name + ScriptedSequenceLabeller.suffix)
+    torch.jit.save(scripted, export_path, _extra_files={METADATA_FILE: json.dumps(metadata)})
+    return export_path
@@ -43,3 +43,29 @@ class CRF(BaseCRF):
 
     def get_transition_scores(self, label_sequences: Tensor) -> Tensor:
         return self.transition_scores[label_sequences[:, :-1], label_sequences[:, 1:]]
+
+
+class FrozenCRF(nn.Module):
+    """
+    Inference-only CRF. The normalized scores that `CRF` recomputes with log_softmax on every access are computed
+    once and stored as buffers under the same names, so the decoders use both the same way.
+    """
+    def __init__(self, num_labels: int):
+        super(FrozenCRF, self).__init__()
+        self.num_labels = num_labels
+
+        self.register_buffer("transition_scores", torch.zeros(num_labels, num_labels))
+        self.register_buffer("prior", torch.zeros(num_labels))
+        self.register_buffer("final_transition_scores", torch.zeros(num_labels))
+
+    @classmethod
+    def from_crf(cls, crf: BaseCRF) -> "FrozenCRF":
+        frozen = cls(num_labels=crf.num_labels).to(crf._prior.device)
+        with torch.no_grad():
+            frozen.transition_scores.copy_(crf.transition_scores)
+            frozen.prior.copy_(crf.prior)
+            frozen.final_transition_scores.copy_(crf.final_transition_scores)
+        return frozen
+
+    def get_transition_scores(self, label_sequences: Tensor) -> Tensor:
+        return self.transition_scores[label_sequences[:, :-1], label_sequences[:, 1:]]
@@ -15,10 +15,13 @@ class ExpansionLayer(nn.Module):
         )
 
     def forward(self, inputs: torch.Tensor) -> torch.Tensor:
-        # Get tensor shape after expansion
-        expanded_shape = list(inputs.shape)
+        expanded_inputs = self.expansion_layer(inputs)
+
+        # Get tensor shape after expansion, taken from the output because a frozen model feeds the linear layer
+        # wider inputs (see `training.trainer.freeze_model`)
+        expanded_shape = list(expanded_inputs.shape)
         expanded_shape[-2] = expanded_shape[-2] * self.tau
+        expanded_shape[-1] = expanded_shape[-1] // self.tau
 
-        expanded_inputs = self.expansion_layer(inputs)
         expanded_inputs = torch.reshape(input=expanded_inputs, shape=expanded_shape)
         return expanded_inputs
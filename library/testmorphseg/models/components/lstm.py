@@ -35,12 +35,14 @@ class BiLSTMEncoder(nn.Module):
         self.h_0 = nn.Parameter(torch.zeros(2 * self.num_layers, 1, self.hidden_size))
         self.c_0 = nn.Parameter(torch.zeros(2 * self.num_layers, 1, self.hidden_size))
 
-    def forward(self, inputs: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+    def forward(self, inputs: torch.Tensor, lengths: torch.Tensor, enforce_sorted: bool = False) -> torch.Tensor:
+        # Callers whose batches are already sorted by decreasing length can set `enforce_sorted`
+        # to skip the sort and unsort around the LSTM
         batch_size = len(lengths)
 
         # Pack sequence
         lengths = torch.clamp(lengths, 1)  # Enforce all lengths are >= 1 (required by pytorch)
-        inputs = pack_padded_sequence(inputs, lengths, batch_first=True, enforce_sorted=False)
+        inputs = pack_padded_sequence(inputs, lengths, batch_first=True, enforce_sorted=enforce_sorted)
 
         # Prepare hidden states
         h_0 = self.h_0.tile((1, batch_size, 1))
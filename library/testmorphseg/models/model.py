@@ -71,9 +71,9 @@ class LSTMModel(nn.Module):
         }
 
     def forward(self, inputs: Tensor, lengths: Tensor, features: Optional[Tensor] = None,
-                feature_lengths: Optional[Tensor] = None) -> Tensor:
+                feature_lengths: Optional[Tensor] = None, enforce_sorted: bool = False) -> Tensor:
         embedded = self.embedding(inputs.to(self.device))
-        encoded = self.encoder(embedded, lengths)
+        encoded = self.encoder(embedded, lengths, enforce_sorted=enforce_sorted)
         if self.use_features:
             encoded = self.feature_encoder(features=features, feature_lengths=feature_lengths, contexts=encoded)
 
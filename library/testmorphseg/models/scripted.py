@@ -0,0 +1,185 @@
+import torch
+import torch.nn as nn
+
+from torch import Tensor
+from typing import List
+from library.testmorphseg.models.model import LSTMModel
+from torch.nn.utils.rnn import pad_packed_sequence
+from torch.nn.utils.rnn import pack_padded_sequence
+
+# Decoder used for each training loss, see `training.trainer._get_loss_function`
+DECODERS = {"cross-entropy": "argmax", "ctc": "argmax", "crf": "viterbi", "ctc-crf": "ctc-crf"}
+
+
+def _length_mask(lengths: Tensor, timesteps: int) -> Tensor:
+    # True at padding positions
+    return torch.arange(timesteps, device=lengths.device).unsqueeze(0) >= lengths.unsqueeze(1)
+
+
+def argmax_decode(logits: Tensor, lengths: Tensor) -> Tensor:
+    predictions = torch.argmax(logits, dim=-1)
+    return torch.masked_fill(predictions, _length_mask(lengths, logits.shape[1]), 0)
+
+
+def viterbi_decode(logits: Tensor, lengths: Tensor, transition_scores: Tensor, prior: Tensor,
+                   final_transition_scores: Tensor) -> Tensor:
+    """Tensor version of `training.inference.viterbi_decode`, returns padded label indices"""
+    batch, timesteps, num_tags = logits.shape
+    emission_scores = torch.log_softmax(logits, dim=-1)
+
+    # Forward recursion
+    alpha = prior.unsqueeze(0) + emission_scores[:, 0, :]
+    alphas = [alpha]
+    back_pointers: List[Tensor] = []
+    for t in range(1, timesteps):
+        alpha, back_pointers_t = torch.max(alpha.unsqueeze(1) + transition_scores, dim=2)
+        alpha = alpha + emission_scores[:, t, :]
+        alphas.append(alpha)
+        back_pointers.append(back_pointers_t)
+
+    last_alpha = torch.stack(alphas, dim=1)[torch.arange(batch, device=logits.device), torch.clamp(lengths - 1, 0)]
+    _, last_tags = torch.max(last_alpha + final_transition_scores.unsqueeze(0), dim=1)
+
+    # Follow back-pointers of all batch elements at once, each one starts at its own last timestep
+    predictions = torch.zeros(batch, timesteps, dtype=torch.long, device=logits.device)
+    tags = last_tags
+    for t in range(timesteps - 1, -1, -1):
+        tags = torch.where(lengths - 1 == t, last_tags, tags)
+        predictions[:, t] = torch.where(lengths > t, tags, torch.zeros_like(tags))
+        if t > 0:
+            tags = back_pointers[t - 1].gather(1, tags.unsqueeze(1)).squeeze(1)
+
+    return predictions
+
+
+def ctc_crf_decode(logits: Tensor, lengths: Tensor, transition_scores: Tensor, prior: Tensor,
+                   final_transition_scores: Tensor) -> Tensor:
+    """Tensor version of `training.inference.ctc_crf_decode`, returns padded label indices (0 is blank)"""
+    batch, timesteps, num_tags = logits.shape
+    emission_scores = torch.log_softmax(logits, dim=-1)
+    batch_prior = prior.unsqueeze(0).expand(batch, num_tags)
+
+    alpha = torch.empty(batch, 0, num_tags, device=logits.device)
+    back_pointers_time: List[Tensor] = []
+    back_pointers_label: List[Tensor] = []
+
+    for t in range(timesteps):
+        # Score of predicting only blanks before t, with t being the first non-blank prediction
+        blank_score = emission_scores[:, :t, 0].sum(dim=1, keepdim=True).expand(batch, num_tags)
+        alpha_t = emission_scores[:, t] + batch_prior + blank_score
+        best_prev_label = torch.full((batch, num_tags), -1, dtype=torch.long, device=logits.device)
+        best_prev_timestep = torch.full((batch, num_tags), -1, dtype=torch.long, device=logits.device)
+
+        if t > 0:
+            # Score of the best previous non-blank timestep s and tag, with blanks at s+1, ..., t-1
+            blank_scores_cum = emission_scores[:, :t, 0].cumsum(dim=1)
+            blank_scores = blank_scores_cum[:, -1].unsqueeze(1) - blank_scores_cum
+            scores = (
+                alpha.unsqueeze(3) + blank_scores.reshape(batch, t, 1, 1) +
+                emission_scores[:, t].reshape(batch, 1, 1, num_tags) +
+                transition_scores.reshape(1, 1, num_tags, num_tags)
+            )
+            scores, s = torch.max(scores, dim=1)
+            scores, prev_label = torch.max(scores, dim=1)
+            s = torch.gather(s, index=prev_label.unsqueeze(1), dim=1).squeeze(1)
+
+            superior = scores > alpha_t
+            alpha_t = torch.where(superior, scores, alpha_t)
+            best_prev_label = torch.where(superior, prev_label, best_prev_label)
+            best_prev_timestep = torch.where(superior, s, best_prev_timestep)
+
+        alpha = torch.cat([alpha, alpha_t.unsqueeze(1)], dim=1)
+        back_pointers_time.append(best_prev_timestep)
+        back_pointers_label.append(best_prev_label)
+
+    # Score of each tag at each timestep being the last non-blank prediction
+    blank_scores_cum = emission_scores[:, :, 0].cumsum(dim=1)
+    blank_scores_final = blank_scores_cum[torch.arange(batch, device=logits.device), lengths - 1].unsqueeze(1)
+    blank_scores = torch.masked_fill(
+        blank_scores_final - blank_scores_cum, _length_mask(lengths, timesteps), -float("inf")
+    )
+    final_scores = alpha + final_transition_scores.reshape(1, 1, -1) + blank_scores.unsqueeze(2)
+
+    final_scores, best_end_timestep = torch.max(final_scores, dim=1)
+    _, best_end_label = torch.max(final_scores, dim=1)
+    best_end_timestep = best_end_timestep.gather(1, best_end_label.unsqueeze(1)).squeeze(1)
+
+    # Follow back-pointers, their chains have different lengths so this runs per batch element
+    time_pointers = torch.stack(back_pointers_time).cpu()
+    label_pointers = torch.stack(back_pointers_label).cpu()
+    end_timesteps: List[int] = best_end_timestep.cpu().tolist()
+    end_labels: List[int] = best_end_label.cpu().tolist()
+    predictions = torch.zeros(batch, timesteps, dtype=torch.long)
+    for batch_idx in range(batch):
+        timestep = end_timesteps[batch_idx]
+        label = end_labels[batch_idx]
+        while timestep != -1:
+            predictions[batch_idx, timestep] = label
+            previous_timestep = int(time_pointers[timestep, batch_idx, label])
+            label = int(label_pointers[timestep, batch_idx, label])
+            timestep = previous_timestep
+
+    return predictions.to(logits.device)
+
+
+class InferenceGraph(nn.Module):
+    """
+    Inference-only copy of a trained LSTMModel together with its decoder, written so it can be compiled with
+    `torch.jit.script`. `forward` maps padded character indices and lengths to padded label indices, where padding
+    (and blanks of CTC models) is label 0.
+    """
+    def __init__(self, model: LSTMModel, loss: str):
+        super(InferenceGraph, self).__init__()
+        if model.use_features:
+            raise ValueError("Models with feature encoders can't be exported.")
+        if loss not in DECODERS:
+            raise ValueError(f"Unknown loss: {loss}")
+
+        self.tau = model.tau
+        self.hidden_size = model.hidden_size
+        self.decoder = DECODERS[loss]
+
+        self.embedding = model.embedding
+        self.lstm = model.encoder.lstm
+        self.h_0 = model.encoder.h_0
+        self.c_0 = model.encoder.c_0
+        self.reduce_dim = model.encoder.reduce_dim
+        if self.tau > 1:
+            self.expansion = model.expansion_layer.expansion_layer
+        else:
+            self.expansion = nn.Identity()
+        self.classifier = model.classifier
+
+        # CRF scores are normalized once here instead of on every batch
+        if model.use_crf:
+            transition_scores = model.crf.transition_scores.T
+            prior = model.crf.prior
+            final_transition_scores = model.crf.final_transition_scores
+        else:
+            transition_scores = prior = final_transition_scores = torch.empty(0)
+        self.register_buffer("transition_scores", transition_scores.detach().clone())
+        self.register_buffer("prior", prior.detach().clone())
+        self.register_buffer("final_transition_scores", final_transition_scores.detach().clone())
+
+    def forward(self, inputs: Tensor, lengths: Tensor, enforce_sorted: bool = False) -> Tensor:
+        batch_size, timesteps = inputs.shape
+        embedded = self.embedding(inputs.to(self.h_0.device))
+
+        packed = pack_padded_sequence(embedded, torch.clamp(lengths, 1).cpu(), batch_first=True,
+                                      enforce_sorted=enforce_sorted)
+        h_0 = self.h_0.tile((1, batch_size, 1))
+        c_0 = self.c_0.tile((1, batch_size, 1))
+        encoded, _ = self.lstm(packed, (h_0, c_0))
+        encoded, _ = pad_packed_sequence(encoded, batch_first=True, total_length=timesteps)
+        encoded = self.reduce_dim(encoded)
+
+        encoded = self.expansion(encoded).reshape(batch_size, self.tau * timesteps, self.hidden_size)
+        logits = self.classifier(encoded)
+
+        lengths = (self.tau * lengths).to(logits.device)
+        if self.decoder == "viterbi":
+            return viterbi_decode(logits, lengths, self.transition_scores, self.prior, self.final_transition_scores)
+        elif self.decoder == "ctc-crf":
+            return ctc_crf_decode(logits, lengths, self.transition_scores, self.prior, self.final_transition_scores)
+        else:
+            return argmax_decode(logits, lengths)
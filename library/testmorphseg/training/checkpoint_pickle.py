@@ -0,0 +1,22 @@
+"""
+Pickle module for `torch.load` that also reads checkpoints saved by the published testmorphseg 0.0.1, whose classes
+lived in `testmorphseg.non_spacy`, e.g. the pretrained models shipped in `models/pretrained_models`.
+"""
+import pickle
+
+# Modules of the classes pickled by testmorphseg 0.0.1 and the modules defining them now
+LEGACY_MODULES = {
+    "testmorphseg.non_spacy.model": "library.testmorphseg.models.model",
+    "testmorphseg.non_spacy.settings": "library.testmorphseg.utils.settings",
+    "testmorphseg.non_spacy.vocabulary": "library.testmorphseg.training.vocabulary",
+    "testmorphseg.non_spacy.metrics": "library.testmorphseg.training.metrics",
+}
+
+
+class Unpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        return super().find_class(LEGACY_MODULES.get(module, module), name)
+
+
+def load(file, **kwargs):
+    return Unpickler(file, **kwargs).load()
@@ -5,12 +5,9 @@ from typing import List
 from torch import Tensor
 from library.testmorphseg.models.model import LSTMModel
 from library.testmorphseg.utils.util import make_mask_2d
-from collections import namedtuple
+from library.testmorphseg.utils.prediction import AlignmentPosition, Prediction
 from library.testmorphseg.training.vocabulary import SequenceLabellingVocabulary
 
-AlignmentPosition = namedtuple("AlignmentPosition", ["symbol", "predictions"])
-Prediction = namedtuple("TransducerPrediction", ["prediction", "alignment"])
-
 
 def _convert_idx(sources: List[List[str]], predictions: List[List[int]],
                  target_vocabulary: SequenceLabellingVocabulary, tau: int) -> List[Prediction]:
@@ -1,5 +1,4 @@
 import numpy as np
-import editdistance
 
 from typing import List
 from typing import Optional
@@ -13,6 +12,9 @@ Metrics = namedtuple(
 
 def get_metrics(predictions: List[List[str]], targets: List[List[str]],
                 losses: Optional[List[float]] = None) -> Metrics:
+    # editdistance is only needed while training, import it lazily
+    import editdistance
+
     assert len(predictions) == len(targets)
     assert len(predictions) > 0
 
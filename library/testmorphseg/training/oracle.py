@@ -1,8 +1,10 @@
-import pandas as pd
 import os
 
 import collections
 
+# Kept importable from here, the inverse of the oracle lives with the inference code
+from library.testmorphseg.utils.actions import rules2sent
+
 
 def sent2rules(source: str, target: str) -> tuple[list[str], list[str]]:
     """
@@ -130,45 +132,10 @@ def sent2rules(source: str, target: str) -> tuple[list[str], list[str]]:
     return list(source), final_actions
 # Comprehensive test suite
 
-def rules2sent(source: str, actions: list[str]) -> str:
-    """
-    Reconstructs the target morpheme string from a source word and a sequence
-    of structured action labels.
-
-    This function is the inverse of the `sent2rules` oracle. It correctly
-    interprets labels like 'COPY', 'DELETE', '@@+COPY', and 'COPY+e'.
-
-    Args:
-        source: The source word.
-        actions: The list of action labels corresponding to each source character.
-
-    Returns:
-        The reconstructed target string.
-    """
-    if len(source) != len(actions):
-        raise ValueError("Length of source and actions must be equal.")
-
-    target_parts = []
-    for char, action in zip(source, actions):
-        if action == 'DELETE':
-            continue
-
-        # Split the action label by '+' to handle compound operations
-        action_parts = action.split('+')
-
-        output_for_char = []
-        for part in action_parts:
-            if part == 'COPY':
-                output_for_char.append(char)
-            else:
-                # This part is a literal string to be inserted/substituted
-                output_for_char.append(part)
-
-        target_parts.append("".join(output_for_char))
-
-    return "".join(target_parts)
-
 def run_oracle(lang, split):
+    # pandas is only needed to read and write the data files, import it lazily
+    import pandas as pd
+
     print(f"Running oracle for language: {lang}, split: {split}")
     label_set = set()
     sources = []
@@ -1,27 +1,43 @@
 from __future__ import annotations
 
+import time
 import torch
 
 from typing import List
 from library.testmorphseg.training.trainer import train
-from tqdm.auto import tqdm
 from typing import Optional
 from library.testmorphseg.utils.settings import Settings
 from library.testmorphseg.training.trainer import load_model
 from library.testmorphseg.training.dataset import RawDataset
 from library.testmorphseg.training.trainer import TrainedModel
-from library.testmorphseg.training.inference import Prediction
+from library.testmorphseg.training.trainer import freeze_model
+from library.testmorphseg.utils.prediction import Prediction, StageTimerMixin
 from library.testmorphseg.training.trainer import _get_loss_function
 from torch.utils.data import DataLoader
 from library.testmorphseg.training.dataset import SequenceLabellingDataset
+from library.testmorphseg.utils.prediction import DEFAULT_MAX_BATCH_CHARS, make_length_batches
 
 
-class SequenceLabeller:
+class SequenceLabeller(StageTimerMixin):
     def __init__(self, settings: Settings) -> None:
         self.settings = settings
         self.model: Optional[TrainedModel] = None
         _, self.inference = _get_loss_function(self.settings.loss)
 
+    def _inference_model(self):
+        # Only touch the module when it isn't ready for inference yet (after loading or training), so concurrent
+        # predict calls on a prepared model don't mutate shared state
+        model = self.model.model
+        device = torch.device(self.settings.device)
+        parameter = next(model.parameters(), None)
+        if parameter is not None and (
+            parameter.device.type != device.type or device.index not in (None, parameter.device.index)
+        ):
+            model.to(device)
+        if model.training:
+            model.eval()
+        return model
+
     @classmethod
     def load(cls, path: str, device) -> SequenceLabeller:
         print(path)
@@ -35,7 +51,24 @@ class SequenceLabeller:
         self.model = train(train_data=train_data, development_data=development_data, settings=self.settings)
         return self
 
-    def predict(self, sources: List[List[str]], features: Optional[List[List[str]]] = None) -> List[Prediction]:
+    def freeze(self) -> SequenceLabeller:
+        """
+        Switch to an inference-only copy of the model with fewer kernels per batch, see `freeze_model`.
+        Predictions stay the same, but the model can't be trained further.
+        """
+        if self.model is None:
+            raise RuntimeError("Freezing uninitialised model")
+        self.model = freeze_model(self.model)
+        return self
+
+    def predict(self, sources: List[List[str]], features: Optional[List[List[str]]] = None,
+                max_batch_chars: int = DEFAULT_MAX_BATCH_CHARS) -> List[Prediction]:
+        """
+        Predict action sequences for `sources`, returned in input order.
+
+        Inputs are sorted by length and batched by a budget of padded characters rather than a fixed count,
+        so short words don't pay for the padding of long ones and the LSTM can skip re-sorting each batch.
+        """
         if self.model is None:
             raise RuntimeError("Running inference with uninitialised model")
 
@@ -43,24 +76,42 @@ class SequenceLabeller:
             dataset=RawDataset(sources=sources, targets=None, features=features),
             source_vocabulary=self.model.source_vocabulary, feature_vocabulary=self.model.feature_vocabulary
         )
+        batch_indices = make_length_batches([len(source) for source in sources], max_batch_chars)
         evaluation_dataloader = DataLoader(
-            evaluation_dataset, batch_size=self.settings.batch_size, shuffle=False,
-            collate_fn=evaluation_dataset.collate_fn
+            evaluation_dataset, batch_sampler=batch_indices, collate_fn=evaluation_dataset.collate_fn
         )
 
-        predictions = []
-        model = self.model.model.to(self.settings.device).eval()
+        predictions: List[Optional[Prediction]] = [None] * len(sources)
+        model = self._inference_model()
+
+        # tqdm is imported lazily to keep `import testmorphseg` fast
+        from tqdm.auto import tqdm
+        batches = tqdm(evaluation_dataloader, desc="Prediction Progress")
+
+        # The dataloader collates each batch while it is being fetched, so the collate stage is the time between
+        # two loop iterations
+        start = time.perf_counter()
+        for indices, batch in zip(batch_indices, batches):
+            self._record_stage("collate", start)
 
-        for batch in tqdm(evaluation_dataloader, desc="Prediction Progress"):
             with torch.no_grad():
+                start = time.perf_counter()
                 logits = model(
                     inputs=batch.sources, lengths=batch.source_lengths,
-                    features=batch.features, feature_lengths=batch.feature_lengths
+                    features=batch.features, feature_lengths=batch.feature_lengths, enforce_sorted=True
                 )
+                self._record_stage("forward", start)
+
+                start = time.perf_counter()
                 batch_predictions = self.inference(
                     model=model, logits=logits, lengths=batch.source_lengths, tau=self.settings.tau,
                     sources=batch.raw_sources, target_vocabulary=self.model.target_vocabulary
                 )
-                predictions.extend(batch_predictions)
+                self._record_stage("decode", start)
+
+            # Put predictions back in input order
+            for idx, prediction in zip(indices, batch_predictions):
+                predictions[idx] = prediction
+            start = time.perf_counter()
 
         return predictions
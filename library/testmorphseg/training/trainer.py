@@ -1,5 +1,7 @@
 import os
+import copy
 import torch
+import hashlib
 import numpy as np
 import torch.nn as nn
 
@@ -9,7 +11,9 @@ from library.testmorphseg.utils.logger import logger
 from typing import Callable
 from typing import Optional
 from library.testmorphseg.models.model import LSTMModel
+from library.testmorphseg.models.components.crf import FrozenCRF
 from library.testmorphseg.training.metrics import Metrics
+from library.testmorphseg.training import checkpoint_pickle
 from library.testmorphseg.utils.settings import Settings
 from library.testmorphseg.training.dataset import RawDataset
 from library.testmorphseg.training.metrics import get_metrics
@@ -28,6 +32,9 @@ Sequence = List[str]
 Sequences = List[Sequence]
 TrainData = Tuple[Sequences, Sequences]
 
+# Supported `quantize_model` modes and the weight dtype each one uses
+QUANTIZATION_DTYPES = {"int8": torch.qint8}
+
 DatasetCollection = namedtuple(
     "DatasetCollection",
     field_names=["source_vocabulary", "target_vocabulary", "feature_vocabulary", "train_dataset", "development_dataset"]
@@ -152,6 +159,8 @@ def save_model(model: TrainedModel, name: str, path: str) -> str:
     model_save_info["metrics"] = model.metrics
     model_save_info["checkpoint"] = model.checkpoint
     model_save_info["settings"] = model.settings
+    model_save_info["quantization"] = getattr(model.model, "quantization", None)
+    model_save_info["frozen"] = getattr(model.model, "frozen", False)
 
     save_model_path = os.path.join(path, name + ".pt")
     torch.save(model_save_info, save_model_path)
@@ -160,9 +169,20 @@ def save_model(model: TrainedModel, name: str, path: str) -> str:
 
 
 def load_model(path: str, device) -> TrainedModel:
-    model_save_info = torch.load(path, weights_only=False, map_location=device)
+    model_save_info = torch.load(path, weights_only=False, map_location=device, pickle_module=checkpoint_pickle)
 
     model = model_save_info["model_class"](**model_save_info["parameters"])
+    if model_save_info.get("frozen", False):
+        # Frozen weights only load into a model with the same fused modules and CRF buffers
+        model = _freeze_modules(model)
+    quantization = model_save_info.get("quantization")
+    if quantization is not None:
+        # Quantized weights only load into a model with the same quantized modules
+        model = torch.ao.quantization.quantize_dynamic(
+            model.eval(), {nn.LSTM, nn.Linear}, dtype=QUANTIZATION_DTYPES[quantization]
+        )
+        model.device = torch.device("cpu")
+        model.quantization = quantization
     model.load_state_dict(model_save_info["state_dict"])
 
     source_vocabulary = model_save_info["source_vocabulary"]
@@ -178,6 +198,102 @@ def load_model(path: str, device) -> TrainedModel:
     )
 
 
+def _update_digest(digest, value) -> None:
+    # Hash state dict entries deterministically, including the packed weights of quantized modules
+    if isinstance(value, torch.Tensor):
+        value = value.detach().cpu()
+        if value.is_quantized:
+            if value.qscheme() in (torch.per_tensor_affine, torch.per_tensor_symmetric):
+                digest.update(repr((value.q_scale(), value.q_zero_point())).encode("utf-8"))
+            else:
+                _update_digest(digest, (value.q_per_channel_scales(), value.q_per_channel_zero_points()))
+            value = value.int_repr()
+        digest.update(value.numpy().tobytes())
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, torch.ScriptObject):
+        _update_digest(digest, value.__getstate__())
+    else:
+        digest.update(repr(value).encode("utf-8"))
+
+
+def model_fingerprint(model: TrainedModel) -> str:
+    """
+    Short content hash of everything a prediction depends on: weights, vocabularies, tau and the decoder.
+    Two checkpoints with the same fingerprint predict the same actions.
+    """
+    digest = hashlib.sha256()
+    for name, value in model.model.state_dict().items():
+        digest.update(name.encode("utf-8"))
+        _update_digest(digest, value)
+    for vocabulary in (model.source_vocabulary, model.target_vocabulary, model.feature_vocabulary):
+        digest.update(repr(vocabulary.alphabet if vocabulary is not None else None).encode("utf-8"))
+    digest.update(f"{model.settings.tau}:{model.settings.loss}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def quantize_model(model: TrainedModel, quantization: str = "int8") -> TrainedModel:
+    """
+    Dynamically quantize the LSTM and Linear layers of a trained model for CPU inference. Weights are stored as
+    int8 and activations are quantized on the fly, the embedding and CRF stay in fp32.
+    """
+    if quantization not in QUANTIZATION_DTYPES:
+        raise ValueError(f"Unknown quantization '{quantization}', supported: {list(QUANTIZATION_DTYPES)}.")
+
+    cpu = torch.device("cpu")
+    quantized = torch.ao.quantization.quantize_dynamic(
+        model.model.to(cpu).eval(), {nn.LSTM, nn.Linear}, dtype=QUANTIZATION_DTYPES[quantization]
+    )
+    quantized.device = cpu
+    quantized.quantization = quantization
+    return model._replace(model=quantized)
+
+
+def _freeze_modules(model: LSTMModel) -> LSTMModel:
+    # Dropout does nothing at inference, replace it with Identity (which keeps the state dict keys)
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, nn.Dropout):
+                setattr(module, name, nn.Identity())
+        if isinstance(module, nn.LSTM):
+            module.dropout = 0.0
+
+    if model.use_crf:
+        model.crf = FrozenCRF.from_crf(model.crf)
+
+    # reduce_dim and the expansion layer's Linear have no nonlinearity between them, so they fold into one Linear.
+    # The feature encoder reads the output of reduce_dim, and the classifier starts with a GELU, so nothing else fuses
+    if model.tau > 1 and not model.use_features:
+        reduce_dim = model.encoder.reduce_dim
+        expansion = model.expansion_layer.expansion_layer[1]
+        fused = nn.Linear(
+            reduce_dim.in_features, expansion.out_features, device=reduce_dim.weight.device,
+            dtype=reduce_dim.weight.dtype
+        )
+        with torch.no_grad():
+            fused.weight.copy_(expansion.weight @ reduce_dim.weight)
+            fused.bias.copy_(expansion.weight @ reduce_dim.bias + expansion.bias)
+        model.expansion_layer.expansion_layer[1] = fused
+        model.encoder.reduce_dim = nn.Identity()
+
+    model.frozen = True
+    return model.eval().requires_grad_(False)
+
+
+def freeze_model(model: TrainedModel) -> TrainedModel:
+    """
+    Inference-only copy of a trained model, with the same predictions up to float rounding: normalized CRF scores
+    are stored as buffers, linear layers without a nonlinearity between them are fused, and dropout is removed.
+    The frozen model can't be trained further.
+    """
+    if getattr(model.model, "quantization", None) is not None:
+        raise ValueError("Quantized models can't be frozen, freeze the model before quantizing it.")
+    if getattr(model.model, "frozen", False):
+        return model
+    return model._replace(model=_freeze_modules(copy.deepcopy(model.model)))
+
+
 def evaluate_on_development_data(model: TrainedModel, development_data: SequenceLabellingDataset,
                                  batch_size: int, loss: str) -> Metrics:
     get_loss, inference = _get_loss_function(loss=loss)
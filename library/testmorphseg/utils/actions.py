@@ -0,0 +1,37 @@
+def rules2sent(source: str, actions: list[str]) -> str:
+    """
+    Reconstructs the target morpheme string from a source word and a sequence
+    of structured action labels.
+
+    This function is the inverse of the `sent2rules` oracle. It correctly
+    interprets labels like 'COPY', 'DELETE', '@@+COPY', and 'COPY+e'.
+
+    Args:
+        source: The source word.
+        actions: The list of action labels corresponding to each source character.
+
+    Returns:
+        The reconstructed target string.
+    """
+    if len(source) != len(actions):
+        raise ValueError("Length of source and actions must be equal.")
+
+    target_parts = []
+    for char, action in zip(source, actions):
+        if action == 'DELETE':
+            continue
+
+        # Split the action label by '+' to handle compound operations
+        action_parts = action.split('+')
+
+        output_for_char = []
+        for part in action_parts:
+            if part == 'COPY':
+                output_for_char.append(char)
+            else:
+                # This part is a literal string to be inserted/substituted
+                output_for_char.append(part)
+
+        target_parts.append("".join(output_for_char))
+
+    return "".join(target_parts)
@@ -1,12 +1,30 @@
 import logging
-from rich.logging import RichHandler
+
+
+class _LazyHandler(logging.Handler):
+    """Creates the wrapped handler on the first record, so importing the logger imports nothing heavy"""
+    def __init__(self, factory, level=logging.NOTSET):
+        super(_LazyHandler, self).__init__(level=level)
+        self._factory = factory
+        self._handler = None
+
+    def emit(self, record):
+        if self._handler is None:
+            self._handler = self._factory()
+        self._handler.handle(record)
+
+
+def _make_shell_handler():
+    from rich.logging import RichHandler
+    return RichHandler()
 
 
 logger = logging.getLogger(__name__)
 
 # handlers
-shell_handler = RichHandler()
-file_handler = logging.FileHandler("debug.log")
+shell_handler = _LazyHandler(_make_shell_handler)
+# delay=True opens debug.log on the first record instead of at import
+file_handler = logging.FileHandler("debug.log", delay=True)
 
 # formatter
 file_fmt = (
@@ -21,4 +39,4 @@ shell_handler.setLevel(logging.DEBUG)
 file_handler.setLevel(logging.DEBUG)
 
 logger.addHandler(shell_handler)
-logger.addHandler(file_handler)
\ No newline at end of file
+logger.addHandler(file_handler)
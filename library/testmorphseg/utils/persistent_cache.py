@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+# Action labels never contain this character, it separates the actions of a word in the database
+ACTION_SEPARATOR = "\x1f"
+# SQLite limits the number of host parameters per statement
+QUERY_CHUNK_SIZE = 500
+
+
+class PersistentActionCache:
+    """
+    SQLite backed word -> action sequence store that outlives the process and can be shared by many processes.
+
+    Entries are keyed by (model fingerprint, word), so a changed checkpoint never sees the predictions of the
+    previous one, and several models can share one file. The database runs in WAL mode, so readers don't
+    block the writer and concurrent processes can read and write it safely. Connections are opened lazily per
+    process, which keeps the cache usable after fork().
+    """
+    def __init__(self, path: str, fingerprint: str, timeout: float = 30.0) -> None:
+        self.path = str(path)
+        self.fingerprint = fingerprint
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection inherited through fork() must not be used, open a fresh one in each process
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS actions ("
+                "fingerprint TEXT NOT NULL, word TEXT NOT NULL, actions TEXT NOT NULL, "
+                "PRIMARY KEY (fingerprint, word)) WITHOUT ROWID"
+            )
+            connection.commit()
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get_many(self, words: Iterable[str]) -> Dict[str, Tuple[str, ...]]:
+        words = list(words)
+        found = dict()
+        with self._lock:
+            connection = self._connect()
+            for start in range(0, len(words), QUERY_CHUNK_SIZE):
+                chunk = words[start:start + QUERY_CHUNK_SIZE]
+                rows = connection.execute(
+                    f"SELECT word, actions FROM actions WHERE fingerprint = ? AND word IN "
+                    f"({', '.join('?' * len(chunk))})",
+                    [self.fingerprint] + chunk
+                )
+                for word, actions in rows:
+                    found[word] = tuple(actions.split(ACTION_SEPARATOR))
+            self.hits += len(found)
+            self.misses += len(words) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[str]]) -> None:
+        if not items:
+            return
+        rows = [(self.fingerprint, word, ACTION_SEPARATOR.join(actions)) for word, actions in items.items()]
+        with self._lock:
+            connection = self._connect()
+            # One transaction for the whole batch, other processes may have stored some of the words meanwhile
+            with connection:
+                connection.executemany("INSERT OR IGNORE INTO actions VALUES (?, ?, ?)", rows)
+
+    def prune(self) -> int:
+        """Delete the entries of every other model, returns the number of deleted entries"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute("DELETE FROM actions WHERE fingerprint != ?", (self.fingerprint,)).rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            connection = self._connect()
+            return connection.execute(
+                "SELECT COUNT(*) FROM actions WHERE fingerprint = ?", (self.fingerprint,)
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+            self._pid = None
+
+    def __getstate__(self) -> dict:
+        # Connections and locks don't survive pickling, the copy opens its own connection on first use
+        state = self.__dict__.copy()
+        state.update(_connection=None, _pid=None, _lock=None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'path': self.path,
+            'fingerprint': self.fingerprint,
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+        }
@@ -0,0 +1,55 @@
+import time
+from typing import Callable, List, Optional
+from collections import namedtuple
+
+# Inference outputs and batching shared by all inference backends, kept free of torch so the NumPy backend
+# can use them too
+AlignmentPosition = namedtuple("AlignmentPosition", ["symbol", "predictions"])
+Prediction = namedtuple("TransducerPrediction", ["prediction", "alignment"])
+
+# Default number of padded characters per inference batch
+DEFAULT_MAX_BATCH_CHARS = 4096
+
+
+def make_length_batches(lengths: List[int], max_batch_chars: int) -> List[List[int]]:
+    """
+    Group indices into batches sorted by decreasing length, closing a batch when its padded size
+    (number of elements times the longest length) would exceed `max_batch_chars`.
+    Every batch holds at least one element.
+    """
+    order = sorted(range(len(lengths)), key=lambda idx: lengths[idx], reverse=True)
+    batches = []
+    batch = []
+    for idx in order:
+        # The first element of a batch is its longest, so it sets the padded length
+        padded_length = max(1, lengths[batch[0]] if batch else lengths[idx])
+        if batch and (len(batch) + 1) * padded_length > max_batch_chars:
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def labels_to_prediction(source: List[str], labels: List[int], target_alphabet: List[str], pad_token: str,
+                         tau: int) -> Prediction:
+    """Decode `tau` label indices per source symbol, dropping padding labels (as `training.inference._convert_idx`)"""
+    alignment = []
+    prediction = []
+    for position, symbol in enumerate(source):
+        decoded = [target_alphabet[label] for label in labels[position * tau:(position + 1) * tau]]
+        decoded = [label for label in decoded if label != pad_token]
+        alignment.append(AlignmentPosition(symbol=symbol, predictions=decoded))
+        prediction.extend(decoded)
+    return Prediction(prediction=prediction, alignment=alignment)
+
+
+class StageTimerMixin:
+    """Reports how long the collate, forward and decode stages of a labeller's `predict` take"""
+    # Optional callback receiving (stage, seconds), set on an instance to enable it
+    stage_timer: Optional[Callable[[str, float], None]] = None
+
+    def _record_stage(self, stage: str, start: float) -> None:
+        if self.stage_timer is not None:
+            self.stage_timer(stage, time.perf_counter() - start)